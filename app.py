@@ -5,12 +5,19 @@ from src.utils import Utils
 from streamlit_lottie import st_lottie
 import requests
 
-# Initialize Utils
-utils = Utils()
-
 # Set the Streamlit page configuration
 st.set_page_config(page_title="Smart Q&A", layout="wide", page_icon="🤖")
 
+
+# Streamlit reruns this script on every interaction, so the backend is created once
+# per process and shared by all reruns and sessions, together with its index cache
+@st.cache_resource(show_spinner=False)
+def get_utils():
+    return Utils()
+
+
+utils = get_utils()
+
 # Custom CSS to make the UI more attractive and user-friendly with a vibrant theme
 st.markdown(
     """
@@ -90,12 +97,26 @@ def start_new_session():
     st.session_state.messages = []
 
 
+# Function to fetch a JSON asset once per process; failures are not cached
+@st.cache_data(show_spinner=False)
+def fetch_json(url: str):
+    r = requests.get(url, timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+
 # Function to load Lottie animation
 def load_lottieurl(url: str):
-    r = requests.get(url)
-    if r.status_code != 200:
+    try:
+        return fetch_json(url)
+    except Exception:
         return None
-    return r.json()
+
+
+# Function to list the indexes, refreshed after an upload or at most every INDEX_LIST_TTL seconds
+@st.cache_data(ttl=int(os.environ.get("INDEX_LIST_TTL", "30")), show_spinner=False)
+def list_indexes():
+    return utils.get_all_indexes()
 
 
 def main():
@@ -130,14 +151,14 @@ def main():
                             buffer.write(uploaded_file.getvalue())
                         result = utils.upload_doc(temp_file_path)
                         os.remove(temp_file_path)
+                        list_indexes.clear()
                         st.success("Document successfully uploaded! ✨")
                     except Exception as e:
                         st.error(f"Upload failed: {e}")
 
         st.header("🔮 Select Document Index")
         try:
-            indexes = utils.get_all_indexes()
-            indexes.insert(0, "")
+            indexes = [""] + list_indexes()
             selected_index = st.selectbox(
                 "Choose your document index", indexes, key="index_select"
             )
@@ -184,26 +205,32 @@ def main():
             "index_name": selected_index,
         }
 
-        with st.spinner("🤖 Processing answer..."):
-            try:
+        try:
+            with st.spinner("🤖 Processing answer..."):
                 new_query = utils.rephrase(query)
-                context = utils.similarity_search(new_query, selected_index)
-                response = utils.qa(new_query, context)
+                docs = utils.similarity_search(new_query, selected_index)
+                context, _ = utils.build_context(new_query, docs)
 
-                st.session_state.messages.append(
-                    {"role": "assistant", "content": response}
+            # Render the answer incrementally as it is generated
+            with st.chat_message("assistant"):
+                response = st.write_stream(
+                    utils.qa_stream(new_query, context, selected_index)
                 )
-                with st.chat_message("assistant"):
-                    st.markdown(
-                        f'<div class="chat-message assistant"><div class="message">{response}</div></div>',
-                        unsafe_allow_html=True,
-                    )
-
-                st.session_state.past_sessions[st.session_state.session_id] = (
-                    st.session_state.messages.copy()
-                )
-            except Exception as e:
-                st.error(f"Failed to process answer: {e}")
+
+            st.session_state.messages.append({"role": "assistant", "content": response})
+            utils.save_conv(
+                st.session_state.session_id,
+                [
+                    {"role": "user", "content": new_query},
+                    {"role": "assistant", "content": response},
+                ],
+            )
+
+            st.session_state.past_sessions[st.session_state.session_id] = (
+                st.session_state.messages.copy()
+            )
+        except Exception as e:
+            st.error(f"Failed to process answer: {e}")
 
     # Footer
     st.markdown("---")
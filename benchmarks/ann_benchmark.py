@@ -0,0 +1,117 @@
+"""
+Recall-vs-latency benchmark for the FAISS index types used by PreprocessDoc.create_index.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.ann_benchmark --vectors 200000 --dim 768
+    python -m benchmarks.ann_benchmark --vectors-file embeddings.npy
+
+Every configuration is compared against exact (flat) search; recall@k is the
+share of the true k nearest neighbours the approximate index returns.
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+from src import ann_index
+
+
+def synthetic_vectors(n, dim, clusters, seed):
+    """
+    Generates clustered Gaussian vectors, which behave more like real embeddings than uniform noise.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    noise = rng.normal(scale=0.3, size=(n, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def evaluate(index, queries, truth, k):
+    """
+    Returns recall@k and the mean per-query latency in milliseconds.
+    """
+    # One query at a time, like the serving path
+    found = []
+    start = time.perf_counter()
+    for query in queries:
+        _, ids = index.search(query.reshape(1, -1), k)
+        found.append(ids[0])
+    latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size, latency_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--vectors-file", help="A .npy file of real embeddings")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.vectors_file:
+        vectors = np.load(args.vectors_file).astype(np.float32)
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + rng.normal(scale=0.1, size=queries.shape).astype(np.float32)
+
+    runs = [(ann_index.default_config("flat"), None)]
+    for ef in args.ef_search:
+        config = ann_index.default_config("hnsw")
+        runs.append((config, {"efSearch": ef}))
+    for nprobe in args.nprobe:
+        config = ann_index.default_config("ivf")
+        runs.append((config, {"nprobe": nprobe}))
+
+    results = []
+    built = {}
+    truth = None
+    for config, search_params in runs:
+        index_type = config["index_type"]
+        if index_type not in built:
+            start = time.perf_counter()
+            index = ann_index.build_index(vectors, config)
+            index.add(vectors)
+            built[index_type] = (index, time.perf_counter() - start)
+        index, build_seconds = built[index_type]
+        if search_params:
+            ann_index.apply_search_params(index, {"search_params": search_params})
+        if truth is None:
+            _, truth = index.search(queries, args.k)
+        recall, latency_ms = evaluate(index, queries, truth, args.k)
+        result = {
+            "index_type": index_type,
+            "params": config["params"],
+            "search_params": search_params or {},
+            "build_seconds": round(build_seconds, 3),
+            f"recall@{args.k}": round(recall, 4),
+            "latency_ms": round(latency_ms, 4),
+        }
+        results.append(result)
+        print(
+            f"{index_type:5} {json.dumps(search_params or {}):20} "
+            f"recall@{args.k}={recall:.4f} latency={latency_ms:.3f}ms "
+            f"build={build_seconds:.1f}s"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"vectors": len(vectors), "dim": vectors.shape[1], "results": results},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+End-to-end benchmark of the FastAPI app with local stand-ins for Gemini.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.e2e_benchmark --pages 10 100 --requests 500 --concurrency 16
+    python -m benchmarks.e2e_benchmark --output new.json --baseline old.json
+
+Synthetic PDFs are ingested through /upload_doc and /qa is driven by a concurrent
+load generator. The chat model and embeddings are deterministic fakes with
+configurable latency (see benchmarks/fakes.py), and all data is written to a
+temporary working directory. Results are saved as JSON; with --baseline the
+run is compared against an earlier result and regressions are flagged.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import httpx
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PeakMemory:
+    """
+    Samples the resident set size of the process in a background thread and keeps the peak.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self):
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            import resource
+
+            # Linux reports the peak in kilobytes
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def percentiles(latencies):
+    """
+    Returns the p50, p95 and p99 of a list of latencies in milliseconds.
+    """
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    values = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {f"p{p}_ms": round(float(v), 3) for p, v in zip((50, 95, 99), values)}
+
+
+async def ingest(client, path, pages, poll_interval):
+    """
+    Uploads a PDF and waits for its ingestion job to finish.
+    """
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        response = await client.post(
+            "/upload_doc",
+            files={"file": (os.path.basename(path), f, "application/pdf")},
+        )
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] in ("completed", "failed"):
+            break
+        await asyncio.sleep(poll_interval)
+    seconds = time.perf_counter() - start
+    completed = job["status"] == "completed"
+    return {
+        "pages": pages,
+        "status": job["status"],
+        "error": job.get("error"),
+        "chunks": job.get("chunks_created"),
+        "seconds": round(seconds, 3),
+        # A failed job has no throughput to compare
+        "pages_per_second": round(pages / seconds, 2) if completed else None,
+    }
+
+
+async def run_load(client, queries, index_name, args):
+    """
+    Sends the queries to /qa (or /qa/stream) with a fixed number of concurrent clients.
+    A request that retrieves no documents counts as an error, since it did not exercise
+    retrieval, unless it was answered from the answer cache, which skips retrieval.
+    """
+    latencies = []
+    first_token = []
+    errors = 0
+    pending = iter(enumerate(queries))
+
+    async def worker():
+        nonlocal errors
+        for i, query in pending:
+            body = {
+                "id": f"bench-{i % args.sessions}",
+                "query": query,
+                "index_name": index_name,
+            }
+            if args.retrieval_mode:
+                body["retrieval_mode"] = args.retrieval_mode
+            start = time.perf_counter()
+            try:
+                if args.stream:
+                    async with client.stream("POST", "/qa/stream", json=body) as r:
+                        r.raise_for_status()
+                        streaming = False
+                        data = None
+                        async for line in r.aiter_lines():
+                            if data is None and line.startswith('data: {"query"'):
+                                data = json.loads(line[len("data: ") :])
+                            if not streaming and line.startswith('data: {"token"'):
+                                first_token.append(time.perf_counter() - start)
+                                streaming = True
+                else:
+                    r = await client.post("/qa", json=body)
+                    r.raise_for_status()
+                    data = r.json()
+                data = data or {}
+                if not data.get("retrieved_documents") and not data.get("cached"):
+                    raise ValueError("No documents were retrieved")
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors += 1
+                print(f"Error in request {i}: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    seconds = time.perf_counter() - start
+    result = {
+        "requests": len(queries),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(latencies) / seconds, 2),
+        **percentiles(latencies),
+    }
+    if args.stream:
+        result["time_to_first_token"] = percentiles(first_token)
+    return result
+
+
+async def run(args, main):
+    from benchmarks.synthetic import make_pdf, make_queries, vocabulary
+
+    words = vocabulary(seed=args.seed)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://benchmark", timeout=None
+    ) as client:
+        ingestion = []
+        texts = []
+        for pages in args.pages:
+            path = f"corpus_{pages}.pdf"
+            texts = make_pdf(path, pages, seed=args.seed + pages, words=words)
+            result = await ingest(client, path, pages, args.poll_interval)
+            print(
+                f"ingest {pages:5} pages: {result['status']} in {result['seconds']}s "
+                f"({result['pages_per_second']} pages/s)"
+            )
+            if result["status"] != "completed":
+                # The load test would only measure queries against a missing index
+                raise RuntimeError(
+                    f"Ingestion of {path} failed: {result['error']}, aborting the benchmark"
+                )
+            ingestion.append(result)
+
+        index_name = f"corpus_{args.pages[-1]}"
+        queries = make_queries(texts, args.requests, seed=args.seed)
+        if args.warmup:
+            # Different queries, so the measured run does not hit the answer cache
+            warmup = make_queries(texts, args.warmup, seed=args.seed + 1)
+            await run_load(client, warmup, index_name, args)
+        qa = await run_load(client, queries, index_name, args)
+        print(
+            f"qa {qa['requests']} requests x{args.concurrency}: "
+            f"{qa['requests_per_second']} req/s p50={qa['p50_ms']}ms "
+            f"p95={qa['p95_ms']}ms p99={qa['p99_ms']}ms errors={qa['errors']}"
+        )
+        stats = (await client.get("/stats")).json()
+    return {"ingestion": ingestion, "qa": qa, "stats": stats}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(result, baseline, tolerance):
+    """
+    Prints the change of every headline metric against a baseline and returns the regressions.
+    """
+    # (label, getter, True if higher is better)
+    metrics = [
+        ("qa requests_per_second", lambda r: r["qa"]["requests_per_second"], True),
+        ("qa p50_ms", lambda r: r["qa"]["p50_ms"], False),
+        ("qa p95_ms", lambda r: r["qa"]["p95_ms"], False),
+        ("qa p99_ms", lambda r: r["qa"]["p99_ms"], False),
+        ("peak_rss_mb", lambda r: r["peak_rss_mb"], False),
+    ]
+    for i, item in enumerate(result["ingestion"]):
+        metrics.append(
+            (
+                f"ingest {item['pages']} pages_per_second",
+                lambda r, i=i: r["ingestion"][i]["pages_per_second"],
+                True,
+            )
+        )
+    regressions = []
+    for label, get, higher_is_better in metrics:
+        try:
+            new, old = get(result), get(baseline)
+        except (KeyError, IndexError, TypeError):
+            continue
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(label)
+        print(f"{label:35} {old:>10} -> {new:>10} ({change:+.1%}) {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--stream", action="store_true", help="Drive /qa/stream")
+    parser.add_argument("--retrieval-mode", choices=["dense", "lexical", "hybrid"])
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--answer-tokens", type=int, default=50)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--embed-text-latency", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Defaults to a new temporary directory")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="A previous JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    # The app keeps its indexes, conversations and caches relative to the working directory
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="e2e_benchmark_"))
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+    import main as app_main
+    from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+    from src.ingestion_jobs import IngestionJobs
+    from src.utils import Utils
+
+    utils = Utils(
+        chat_model=FakeChatModel(
+            first_token_latency=args.llm_latency,
+            token_latency=args.token_latency,
+            answer_tokens=args.answer_tokens,
+        ),
+        embedding_function=FakeEmbeddings(
+            args.dim, args.embed_latency, args.embed_text_latency
+        ),
+    )
+    app_main.utils = utils
+    app_main.ingestion_jobs = IngestionJobs(utils.upload_doc)
+
+    with PeakMemory() as memory:
+        result = asyncio.run(run(args, app_main))
+    result = {
+        "benchmark": "e2e",
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("workdir", "output", "baseline")
+        },
+        "environment": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        **result,
+        "peak_rss_mb": round(memory.peak / 2**20, 1),
+    }
+    print(f"peak RSS {result['peak_rss_mb']} MB, working directory {os.getcwd()}")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+    if baseline:
+        with open(baseline, "r") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
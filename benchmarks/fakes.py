@@ -0,0 +1,96 @@
+"""
+Deterministic local stand-ins for the Gemini chat model and embeddings, with
+configurable latency, so benchmarks measure our own code without spending quota.
+"""
+
+from functools import lru_cache
+import asyncio
+import hashlib
+import re
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    A chat model answering with words derived from a hash of the prompt. It waits
+    first_token_latency before the first token and token_latency between tokens.
+    """
+
+    first_token_latency: float = 0.5
+    token_latency: float = 0.01
+    answer_tokens: int = 50
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        digest = hashlib.sha256(messages[-1].content.encode("utf-8")).digest()
+        return [f"w{digest[i % len(digest)]}{i} " for i in range(self.answer_tokens)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(self.first_token_latency + self.token_latency * (len(tokens) - 1))
+        message = AIMessage(content="".join(tokens).strip())
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        await asyncio.sleep(
+            self.first_token_latency + self.token_latency * (len(tokens) - 1)
+        )
+        message = AIMessage(content="".join(tokens).strip())
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens(messages)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+@lru_cache(maxsize=100000)
+def _word_vector(word, size):
+    seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(size).astype(np.float32)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Bag-of-words embeddings built from hashed word vectors, so texts sharing words
+    are close. Every call waits latency seconds plus text_latency per text.
+    """
+
+    def __init__(self, size=768, latency=0.05, text_latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.text_latency = text_latency
+        self.model = f"fake-embedding-{size}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector += _word_vector(word, self.size)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency + self.text_latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency + self.text_latency)
+        return self._embed(text)
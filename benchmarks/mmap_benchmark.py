@@ -0,0 +1,205 @@
+"""
+Memory per worker of the heap and the memory-mapped index loaders.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.mmap_benchmark --chunks 100000 --workers 4
+    python -m benchmarks.mmap_benchmark --index-type hnsw --output mmap.json
+
+A synthetic index is built in a temporary working directory. For each loader,
+the given number of worker processes load the index, search it until every
+vector page has been touched, and report their load time and memory while all
+of them hold the index. Proportional set size (PSS) splits shared pages between
+the processes mapping them, so it is the share of host memory each worker costs.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.e2e_benchmark import REPO_ROOT, git_commit
+
+INDEX_NAME = "mmap_benchmark"
+
+
+def memory():
+    """
+    Returns the resident (RSS), proportional (PSS) and private (USS) memory of the process in bytes.
+    """
+    try:
+        fields = {}
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0]) * 1024
+        return {
+            "rss": fields["Rss"],
+            "pss": fields["Pss"],
+            "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+        }
+    except OSError:
+        import psutil
+
+        info = psutil.Process().memory_full_info()
+        return {
+            "rss": info.rss,
+            "pss": getattr(info, "pss", info.uss),
+            "uss": info.uss,
+        }
+
+
+def build(chunks, dim, index_type, seed):
+    """
+    Builds and saves a synthetic index of random unit vectors with short chunk texts.
+    """
+    from langchain_core.documents import Document
+    from benchmarks.fakes import FakeEmbeddings
+    from benchmarks.synthetic import vocabulary
+    from src.preprocess_doc import PreprocessDoc
+
+    rng = np.random.default_rng(seed)
+    words = vocabulary(seed=seed)
+    vectors = rng.standard_normal((chunks, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    documents = [
+        Document(
+            page_content=" ".join(rng.choice(words, 60)),
+            metadata={"source": f"{INDEX_NAME}.pdf", "page": i // 10},
+        )
+        for i in range(chunks)
+    ]
+    preprocess_doc = PreprocessDoc(FakeEmbeddings(dim, latency=0))
+    start = time.perf_counter()
+    index = preprocess_doc.create_index(documents, INDEX_NAME, vectors, index_type)
+    if index is None:
+        raise RuntimeError("The benchmark index could not be built")
+    seconds = time.perf_counter() - start
+    # Flush the new files, so mapped pages are clean page cache shared across processes
+    os.sync()
+    return seconds
+
+
+def worker(mmap, dim, searches, loaded, done, results):
+    from benchmarks.fakes import FakeEmbeddings
+    from src.preprocess_doc import PreprocessDoc
+
+    preprocess_doc = PreprocessDoc(FakeEmbeddings(dim, latency=0))
+    before = memory()
+    start = time.perf_counter()
+    index = preprocess_doc.get_index(INDEX_NAME, mmap=mmap)
+    load_seconds = time.perf_counter() - start
+    queries = np.random.default_rng(os.getpid()).standard_normal(
+        (searches, dim), dtype=np.float32
+    )
+    start = time.perf_counter()
+    for query in queries:
+        index.similarity_search_by_vector(query.tolist(), k=3)
+    search_seconds = time.perf_counter() - start
+    # Measure once every worker holds the index, so shared pages are split between them
+    loaded.wait()
+    after = memory()
+    results.put(
+        {
+            "load_seconds": load_seconds,
+            "search_ms": search_seconds / searches * 1000,
+            **{f"{key}_bytes": value - before[key] for key, value in after.items()},
+        }
+    )
+    done.wait()
+
+
+def run_loader(mmap, args):
+    """
+    Starts the worker processes with one loader and collects their measurements.
+    """
+    # Spawned workers start from a clean interpreter instead of sharing the parent's pages
+    context = multiprocessing.get_context("spawn")
+    loaded = context.Barrier(args.workers)
+    done = context.Barrier(args.workers + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=worker,
+            args=(mmap, args.dim, args.searches, loaded, done, results),
+        )
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    done.wait()
+    for process in processes:
+        process.join()
+
+    def mean(key, scale=1):
+        return round(sum(m[key] for m in measurements) / len(measurements) * scale, 3)
+
+    return {
+        "workers": args.workers,
+        "load_seconds": mean("load_seconds"),
+        "search_ms": mean("search_ms"),
+        "rss_mb_per_worker": mean("rss_bytes", 1 / 2**20),
+        "pss_mb_per_worker": mean("pss_bytes", 1 / 2**20),
+        "uss_mb_per_worker": mean("uss_bytes", 1 / 2**20),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--index-type", choices=["flat", "hnsw", "ivf"], default="flat")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--searches", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Defaults to a new temporary directory")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="mmap_benchmark_"))
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+    build_seconds = build(args.chunks, args.dim, args.index_type, args.seed)
+    print(f"built {args.chunks} chunks ({args.index_type}) in {build_seconds:.1f}s")
+    loaders = {}
+    for name, mmap in (("heap", False), ("mmap", True)):
+        loaders[name] = result = run_loader(mmap, args)
+        print(
+            f"{name}: load {result['load_seconds']}s, search {result['search_ms']}ms, "
+            f"per worker RSS {result['rss_mb_per_worker']} MB, "
+            f"PSS {result['pss_mb_per_worker']} MB, USS {result['uss_mb_per_worker']} MB"
+        )
+
+    result = {
+        "benchmark": "mmap",
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("workdir", "output")
+        },
+        "environment": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "build_seconds": round(build_seconds, 3),
+        "loaders": loaders,
+    }
+    print(f"working directory {os.getcwd()}")
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
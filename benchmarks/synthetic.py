@@ -0,0 +1,115 @@
+"""
+Synthetic corpora for the benchmarks: seeded pseudo-text with fund codes, written
+as minimal single-font PDFs and sampled into queries.
+"""
+
+import random
+
+SYLLABLES = ("ba", "ke", "lo", "mi", "nu", "ra", "si", "to", "ve", "zu", "qua", "ter")
+
+
+def vocabulary(size=2000, seed=0):
+    """
+    Returns a list of pronounceable pseudo-words, with a share of fund codes such as "MF-1042".
+    """
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        if rng.random() < 0.05:
+            words.add(f"MF-{rng.randint(1000, 9999)}")
+        else:
+            words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def page_lines(words, lines, words_per_line, rng):
+    # Zipf-like word frequencies, like natural text
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    return [
+        " ".join(rng.choices(words, weights=weights, k=words_per_line))
+        for _ in range(lines)
+    ]
+
+
+def make_pdf(path, pages, seed=0, lines=40, words_per_line=12, words=None):
+    """
+    Writes a PDF of the given number of text pages.
+
+    Args:
+    - path (str): The path of the PDF to write.
+    - pages (int): The number of pages.
+    - seed (int, optional): The seed of the generated text. Defaults to 0.
+    - lines (int, optional): The number of lines per page. Defaults to 40.
+    - words_per_line (int, optional): The number of words per line. Defaults to 12.
+    - words (list, optional): The vocabulary. Defaults to `vocabulary(seed=seed)`.
+
+    Returns:
+    - list: The text lines of every page.
+    """
+    rng = random.Random(seed)
+    words = words or vocabulary(seed=seed)
+    texts = [page_lines(words, lines, words_per_line, rng) for _ in range(pages)]
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # The page tree, written once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in texts:
+        stream = "BT /F1 10 Tf 40 760 Td 12 TL " + " ".join(
+            f"({line}) '" for line in page
+        )
+        stream += " ET"
+        objects.append(
+            f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode()
+        )
+        content_id = len(objects)
+        objects.append(
+            (
+                "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode()
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += (
+        f"trailer << /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n"
+    ).encode()
+    with open(path, "wb") as f:
+        f.write(out)
+    return texts
+
+
+def make_queries(texts, count, seed=0, length=6):
+    """
+    Samples queries from runs of words of the generated pages, so every query has relevant chunks.
+
+    Args:
+    - texts (list): The page lines returned by `make_pdf`.
+    - count (int): The number of queries.
+    - seed (int, optional): The sampling seed. Defaults to 0.
+    - length (int, optional): The number of words per query. Defaults to 6.
+
+    Returns:
+    - list: The queries.
+    """
+    rng = random.Random(seed)
+    lines = [line for page in texts for line in page]
+    queries = []
+    for _ in range(count):
+        words = rng.choice(lines).split()
+        start = rng.randint(0, max(0, len(words) - length))
+        queries.append("What is " + " ".join(words[start : start + length]) + "?")
+    return queries
@@ -1,22 +1,78 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal, Optional, Union
+from functools import partial
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import os
 from src.utils import Utils
+from src.ingestion_jobs import IngestionJobs
+from src import ann_index
+from src.metrics import metrics
+
+UPLOAD_BLOCK_SIZE = 1024 * 1024
 
-app = FastAPI()
 utils = Utils()
+ingestion_jobs = IngestionJobs(utils.upload_doc)
+
+
+async def compact_convs_periodically():
+    """
+    Deletes the conversations older than CONV_RETENTION_DAYS every CONV_COMPACT_INTERVAL seconds.
+    """
+    interval = float(os.environ.get("CONV_COMPACT_INTERVAL", "3600"))
+    while True:
+        await utils.acompact_convs()
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts serving immediately. When PRELOAD_INDEXES (a comma-separated list of index names,
+    or "*" for all) or WARMUP_ON_STARTUP=1 is set, the clients are built and the indexes
+    loaded in the background; /ready reports when that is done. When CONV_RETENTION_DAYS
+    is set, expired conversations are deleted periodically.
+    """
+    preload = [
+        name.strip()
+        for name in os.environ.get("PRELOAD_INDEXES", "").split(",")
+        if name.strip()
+    ]
+    if preload == ["*"]:
+        preload = utils.get_all_indexes()
+    app.state.warmup = None
+    if preload or os.environ.get("WARMUP_ON_STARTUP", "0") == "1":
+        app.state.warmup = asyncio.create_task(utils.awarmup(preload))
+    compaction = None
+    if float(os.environ.get("CONV_RETENTION_DAYS", "0")) > 0:
+        compaction = asyncio.create_task(compact_convs_periodically())
+    yield
+    if app.state.warmup is not None:
+        app.state.warmup.cancel()
+    if compaction is not None:
+        compaction.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+# Exports request and stage spans when OTEL_EXPORTER_OTLP_ENDPOINT is set
+metrics.setup_tracing(app)
 
 
 class Query(BaseModel):
     """
-    Represents a query with an ID, the query string, and the index name.
+    Represents a query with an ID, the query string, and the index name
+    or a list of index names to search together. The optional retrieval_mode
+    selects dense, lexical (BM25) or hybrid retrieval.
     """
 
     id: str
     query: str
-    index_name: str
+    index_name: Union[str, List[str]]
+    retrieval_mode: Optional[Literal["dense", "lexical", "hybrid"]] = None
 
 
 @app.get("/")
@@ -27,72 +83,319 @@ async def root():
     return {"message": "Hello World"}
 
 
-@app.post("/upload_doc")
-async def upload_document(file: UploadFile = File(...)):
+@app.get("/ready")
+async def ready():
     """
-    Handles the upload of a document, saving it temporarily, processing it, and removing the temporary file.
+    Reports whether the startup warm-up is done, returning 503 while it is still running.
     """
+    warmup = getattr(app.state, "warmup", None)
+    if warmup is None:
+        return {"ready": True}
+    if not warmup.done():
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True, **warmup.result()}
+
+
+async def stage_upload(file):
+    """
+    Registers an ingestion job for an uploaded file and streams the file to disk in
+    fixed-size blocks. The job is marked as failed if the upload cannot be written.
+
+    Returns:
+    - tuple: The job ID and the path of the staged upload.
+    """
+    job_id, temp_file_path = ingestion_jobs.create(file.filename)
     try:
-        # Save the uploaded file temporarily
-        temp_file_path = f"temp_{file.filename}"
-        temp_file_path = temp_file_path.replace(" ", "_")
         with open(temp_file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+            while block := await file.read(UPLOAD_BLOCK_SIZE):
+                buffer.write(block)
+    except Exception as e:
+        ingestion_jobs.fail(job_id, str(e))
+        raise
+    return job_id, temp_file_path
 
-        # Upload the document using Utils
-        result = utils.upload_doc(temp_file_path)
 
-        # Remove the temporary file
-        os.remove(temp_file_path)
+@app.post("/upload_doc")
+async def upload_document(
+    file: UploadFile = File(...), index_type: Optional[str] = None
+):
+    """
+    Handles the upload of a document, streaming it to disk and queueing it for background ingestion.
+    Returns the ID of the ingestion job, whose progress is reported by /jobs/{job_id}.
+    The optional index_type ("flat", "hnsw" or "ivf") selects exact or approximate search.
+    """
+    try:
+        if index_type is not None:
+            ann_index.default_config(
+                index_type
+            )  # Reject unknown types before the upload
+        job_id, temp_file_path = await stage_upload(file)
+
+        # Ingest the document in the background using Utils
+        ingestion_jobs.submit(
+            job_id, temp_file_path, partial(utils.upload_doc, index_type=index_type)
+        )
 
-        return {"message": result}
+        return {"message": "Upload queued", "job_id": job_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Retrieves the status and stage-level progress of an ingestion job.
+    """
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
+@app.post("/indexes/{index_name}/documents")
+async def add_document(index_name: str, file: UploadFile = File(...)):
+    """
+    Handles adding a document to an existing index without rebuilding it. A document with the
+    same file name replaces its earlier version. Returns the ID of the ingestion job.
+    """
+    try:
+        utils.validate_index_name(index_name)
+        job_id, temp_file_path = await stage_upload(file)
+
+        ingestion_jobs.submit(
+            job_id, temp_file_path, partial(utils.add_doc, index_name=index_name)
+        )
+
+        return {"message": "Upload queued", "job_id": job_id}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/indexes/{index_name}/documents/{doc_id}")
+async def delete_document(index_name: str, doc_id: str):
+    """
+    Deletes every chunk of a source document from an index.
+    """
+    try:
+        deleted = await utils.adelete_doc(index_name, doc_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+    return {"message": "Delete Successful!", "deleted_chunks": deleted}
+
+
 @app.get("/get_indexes", response_model=List[str])
-async def get_indexes():
+async def get_indexes(
+    prefix: str = "", cursor: Optional[str] = None, limit: Optional[int] = None
+):
     """
-    Retrieves all available indexes.
+    Retrieves the available indexes in name order, optionally only those starting with
+    a prefix. For paging, pass a limit and the last name of the previous page as cursor.
     """
     try:
-        indexes = utils.get_all_indexes()
+        indexes = utils.get_all_indexes(prefix, cursor, limit)
         return indexes
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/indexes")
+async def get_index_catalog(
+    prefix: str = "", cursor: Optional[str] = None, limit: Optional[int] = 100
+):
+    """
+    Retrieves a page of the index catalog with the metadata of every index (chunk count,
+    size, embedding model, build time). Pass next_cursor as cursor for the next page.
+    """
+    try:
+        return utils.get_index_catalog(prefix, cursor, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def retrieve_and_lookup(query):
+    """
+    Rephrases the query while documents are retrieved for the raw query, then looks the
+    rephrased query up in the answer cache while retrieval is still running. On a cache hit
+    retrieval is abandoned and no context is built. The raw query is embedded once, for
+    retrieval and, if it was not rephrased, for the answer cache.
+
+    Returns:
+    - tuple: The rephrased query, the answer cache result to pass to aqa / aqa_stream, and
+      the retrieved documents, the context and the prompt size, which are None on a hit.
+    """
+    vector = utils.submit_query_embedding(
+        query.query, query.index_name, query.retrieval_mode
+    )
+    retrieval = asyncio.ensure_future(
+        utils.asimilarity_search(
+            query.query, query.index_name, query.retrieval_mode, vector
+        )
+    )
+    try:
+        new_query = await utils.arephrase({"id": query.id, "query": query.query})
+        cached = await utils.alookup_answer(
+            new_query,
+            query.index_name,
+            query.retrieval_mode,
+            vector if new_query == query.query else None,
+        )
+        if cached[0] is not None:
+            retrieval.cancel()
+            vector.cancel()
+            return new_query, cached, None, None, None
+        docs = await retrieval
+    except BaseException:
+        retrieval.cancel()
+        vector.cancel()
+        raise
+    context, prompt_tokens = await utils.abuild_context(new_query, docs)
+    return new_query, cached, docs, context, prompt_tokens
+
+
 @app.post("/qa")
 async def question_answering(query: Query):
     """
     Handles question answering based on a given query.
     """
     try:
-        context = utils.similarity_search(query.query, query.index_name)
-        new_query = utils.rephrase({"id": query.id, "query": query.query})
-        response = utils.qa(new_query, context)
+        utils.validate_index_name(query.index_name)
+        utils.conv_store.validate_id(query.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        new_query, cached, docs, context, prompt_tokens = await retrieve_and_lookup(
+            query
+        )
+        response = await utils.aqa(
+            new_query, context, query.index_name, query.retrieval_mode, cached
+        )
 
         # Save the conversation
         conv = [
             {"role": "user", "content": new_query},
             {"role": "assistant", "content": response},
         ]
-        utils.save_conv(query.id, conv)
+        await utils.asave_conv(query.id, conv)
         print(f"BOT: {response}")
-        return {"query": new_query, "response": response}
+        return {
+            "query": new_query,
+            "response": response,
+            "prompt_tokens": prompt_tokens,
+            "retrieved_documents": None if docs is None else len(docs),
+            "cached": docs is None,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/qa/stream")
+async def question_answering_stream(query: Query):
+    """
+    Handles question answering based on a given query, streaming the answer as Server-Sent Events.
+    """
+    try:
+        utils.validate_index_name(query.index_name)
+        utils.conv_store.validate_id(query.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        new_query, cached, docs, context, prompt_tokens = await retrieve_and_lookup(
+            query
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        data = {
+            "query": new_query,
+            "prompt_tokens": prompt_tokens,
+            "retrieved_documents": None if docs is None else len(docs),
+            "cached": docs is None,
+        }
+        yield f"event: query\ndata: {json.dumps(data)}\n\n"
+        tokens = []
+        async for token in utils.aqa_stream(
+            new_query, context, query.index_name, query.retrieval_mode, cached
+        ):
+            tokens.append(token)
+            yield f"data: {json.dumps({'token': token})}\n\n"
+        response = "".join(tokens)
+
+        # Save the conversation once the whole answer has been streamed
+        conv = [
+            {"role": "user", "content": new_query},
+            {"role": "assistant", "content": response},
+        ]
+        await utils.asave_conv(query.id, conv)
+        print(f"BOT: {response}")
+        yield f"event: done\ndata: {json.dumps({'query': new_query, 'response': response})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def stats():
+    """
+    Retrieves the index cache, answer cache, rephrase, context, embedding cache and embedding
+    pipeline counters, and whether indexes are memory-mapped.
+    """
+    return {
+        "index_cache": utils.index_cache.stats(),
+        "answer_cache": utils.answer_cache.stats(),
+        "rephrase": utils.rephrase_router.stats(),
+        "context": utils.context_builder.stats(),
+        "embedding_cache": utils.preprocess_doc.embedding_cache.stats(),
+        "embedding_pipeline": utils.preprocess_doc.embedding_pipeline.stats(),
+        "index_mmap": {
+            "enabled": os.environ.get("INDEX_MMAP", "0") == "1",
+            **ann_index.mmap_stats(),
+        },
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Exposes the stage latency histograms and counters in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/get_convs")
-async def get_conv(id: str):
+async def get_conv(id: str, limit: Optional[int] = None):
     """
-    Retrieves a conversation history based on the given ID.
+    Retrieves a conversation history based on the given ID, or only its last limit messages.
     """
     try:
-        conv = utils.get_all_convs()
-        return conv
+        utils.conv_store.validate_id(id)
+        conv = await utils.aget_conv_history(id, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not conv:
+        raise HTTPException(status_code=404, detail=f"Conversation not found: {id}")
+    return conv
+
+
+@app.get("/convs")
+async def list_convs(cursor: Optional[str] = None, limit: int = 50):
+    """
+    Lists conversations, most recently updated first. Pass next_cursor as cursor for the next page.
+    """
+    try:
+        return await utils.alist_convs(cursor, limit)
+    except ValueError as e:
+        # A malformed cursor or limit
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
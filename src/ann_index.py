@@ -0,0 +1,206 @@
+import math
+import os
+import threading
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+
+# index type -> number of memory-mapped reads that fell back to reading into memory
+_mmap_fallbacks = {}
+_mmap_lock = threading.Lock()
+
+
+def default_config(index_type=None):
+    """
+    Returns the build and search parameters of an index type, with defaults taken
+    from the environment.
+
+    Args:
+    - index_type (str, optional): One of "flat", "hnsw" or "ivf". Defaults to the
+      FAISS_INDEX_TYPE environment variable, or "flat".
+
+    Returns:
+    - dict: The index type with its build parameters ("params") and search parameters ("search_params").
+    """
+    if index_type is None:
+        index_type = os.environ.get("FAISS_INDEX_TYPE", "flat")
+    index_type = index_type.lower()
+    if index_type == "flat":
+        return {"index_type": "flat", "params": {}, "search_params": {}}
+    if index_type == "hnsw":
+        return {
+            "index_type": "hnsw",
+            "params": {
+                "M": int(os.environ.get("HNSW_M", "32")),
+                "efConstruction": int(os.environ.get("HNSW_EF_CONSTRUCTION", "40")),
+            },
+            "search_params": {
+                "efSearch": int(os.environ.get("HNSW_EF_SEARCH", "64")),
+            },
+        }
+    if index_type == "ivf":
+        nlist = os.environ.get("IVF_NLIST")
+        return {
+            "index_type": "ivf",
+            # Without an explicit nlist it is derived from the corpus size at build time
+            "params": {"nlist": int(nlist) if nlist else None},
+            "search_params": {"nprobe": int(os.environ.get("IVF_NPROBE", "8"))},
+        }
+    raise ValueError(f"Unknown index type: {index_type}. Choose one of {INDEX_TYPES}")
+
+
+def build_index(vectors, config):
+    """
+    Builds an empty FAISS index of the configured type. IVF indexes are trained on the given vectors.
+
+    Args:
+    - vectors (numpy.ndarray): The float32 vectors the index will hold, shaped (n, d).
+    - config (dict): The index configuration, as returned by `default_config`.
+
+    Returns:
+    - faiss.Index: The index, ready for the vectors to be added.
+    """
+    n, d = vectors.shape
+    params = config["params"]
+    if config["index_type"] == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif config["index_type"] == "hnsw":
+        index = faiss.IndexHNSWFlat(d, params["M"])
+        index.hnsw.efConstruction = params["efConstruction"]
+    elif config["index_type"] == "ivf":
+        # Roughly 4 * sqrt(n) centroids, with enough points per centroid to train them
+        nlist = params.get("nlist") or max(1, int(4 * math.sqrt(n)))
+        nlist = max(1, min(nlist, n // 39 or 1))
+        params["nlist"] = nlist
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(d), d, nlist)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown index type: {config['index_type']}")
+    apply_search_params(index, config)
+    return index
+
+
+def read_index(path, index_type="flat", mmap=False):
+    """
+    Reads a FAISS index from a file. With mmap the vectors are memory-mapped read-only
+    instead of copied onto the heap, so every process serving the index shares one copy
+    in the page cache. A mapped index must not be modified.
+
+    Args:
+    - path (str): The path of the index file.
+    - index_type (str, optional): The index type, "flat", "hnsw" or "ivf". Defaults to "flat".
+    - mmap (bool, optional): Whether to memory-map the vectors. Defaults to False.
+
+    Returns:
+    - faiss.Index: The index. Read into memory if this FAISS build cannot map it.
+    """
+    if mmap:
+        flags = mmap_flags(index_type)
+        if flags:
+            try:
+                return faiss.read_index(path, flags | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                print(f"Error memory-mapping index, reading it instead: {e}")
+        else:
+            print(
+                f"Warning: FAISS {faiss.__version__} cannot memory-map {index_type} "
+                "indexes, reading it into memory instead"
+            )
+        with _mmap_lock:
+            _mmap_fallbacks[index_type] = _mmap_fallbacks.get(index_type, 0) + 1
+    return faiss.read_index(path)
+
+
+def mmap_flags(index_type="flat"):
+    """
+    Returns the FAISS read flags that memory-map an index type.
+
+    Args:
+    - index_type (str, optional): The index type, "flat", "hnsw" or "ivf". Defaults to "flat".
+
+    Returns:
+    - int: The flags, or 0 if this FAISS build cannot map the index type.
+    """
+    if index_type == "ivf":
+        return faiss.IO_FLAG_MMAP
+    # Flat and HNSW vector storage can only be mapped by newer FAISS releases
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def mmap_stats():
+    """
+    Returns whether each index type can be memory-mapped by this FAISS build, and how
+    many memory-mapped reads fell back to reading the index into memory.
+
+    Returns:
+    - dict: The FAISS version, the supported index types and the fallbacks per index type.
+    """
+    with _mmap_lock:
+        fallbacks = dict(_mmap_fallbacks)
+    return {
+        "faiss_version": faiss.__version__,
+        "supported": {
+            index_type: bool(mmap_flags(index_type)) for index_type in INDEX_TYPES
+        },
+        "fallbacks": fallbacks,
+    }
+
+
+def apply_search_params(index, config):
+    """
+    Applies the search parameters (efSearch, nprobe) of a configuration to a FAISS index.
+
+    Args:
+    - index (faiss.Index): The FAISS index.
+    - config (dict): The index configuration, as returned by `default_config`.
+    """
+    parameter_space = faiss.ParameterSpace()
+    for name, value in config.get("search_params", {}).items():
+        parameter_space.set_index_parameter(index, name, value)
+
+
+def supports_remove(index):
+    """
+    Checks whether vectors can be removed from a FAISS index in place while keeping
+    the positions of the remaining vectors contiguous.
+
+    Args:
+    - index (faiss.Index): The FAISS index.
+
+    Returns:
+    - bool: True for flat indexes. HNSW graphs cannot remove vectors and IVF lists keep
+      the original IDs, so those indexes must be rebuilt instead.
+    """
+    return isinstance(index, faiss.IndexFlat)
+
+
+def rebuild_without(index, positions, config):
+    """
+    Rebuilds a FAISS index without the vectors at the given positions, keeping the
+    remaining vectors in their original order. IVF indexes keep their trained centroids.
+
+    Args:
+    - index (faiss.Index): The FAISS index.
+    - positions (set): The positions of the vectors to drop.
+    - config (dict): The index configuration, as returned by `default_config`.
+
+    Returns:
+    - faiss.Index: The rebuilt index.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    vectors = index.reconstruct_n(0, index.ntotal)
+    keep = np.array(
+        [i for i in range(index.ntotal) if i not in positions], dtype=np.int64
+    )
+    vectors = np.ascontiguousarray(vectors[keep], dtype=np.float32)
+    if ivf is not None:
+        new_index = faiss.clone_index(index)
+        new_index.reset()
+        apply_search_params(new_index, config)
+    else:
+        new_index = build_index(vectors, config)
+    new_index.add(vectors)
+    return new_index
@@ -0,0 +1,204 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+import numpy as np
+
+
+class AnswerCache:
+    """
+    A cache of answers keyed on the rephrased query within an index. A lookup
+    matches on an exact hash of the normalized query first and then on the
+    cosine similarity of the query embedding to the cached queries. Answers
+    are only served while the indexes they came from are at the same version.
+    """
+
+    def __init__(
+        self, embed, threshold=None, ttl=None, max_entries=None, version_of=None
+    ):
+        """
+        Initializes the AnswerCache.
+
+        Args:
+        - embed (callable): A function taking a query and returning its embedding.
+        - threshold (float, optional): The minimum cosine similarity for a semantic hit. Defaults to the
+          ANSWER_CACHE_THRESHOLD environment variable, or 0.95. A value above 1 disables semantic matching.
+        - ttl (float, optional): The number of seconds an answer stays valid. Defaults to the
+          ANSWER_CACHE_TTL environment variable, or 3600.
+        - max_entries (int, optional): The maximum number of cached answers across all indexes. Defaults to the
+          ANSWER_CACHE_MAX_ENTRIES environment variable, or 1000.
+        - version_of (callable, optional): A function taking an index name and returning its current
+          version, e.g. from the index catalog, so answers from an older version are dropped
+          even when the index was rewritten by another process.
+        """
+        if threshold is None:
+            threshold = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+        if ttl is None:
+            ttl = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+        if max_entries is None:
+            max_entries = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_of = version_of
+        # (index name, query hash) -> (answer, vector, created, index versions)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(query):
+        normalized = " ".join(query.lower().split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def normalize(vector):
+        """
+        Scales a query embedding to unit length, as the cached embeddings are compared by dot product.
+
+        Args:
+        - vector (list or numpy.ndarray): The query embedding.
+
+        Returns:
+        - numpy.ndarray: The normalized embedding.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _embed(self, query):
+        return self.normalize(self.embed(query))
+
+    def _versions(self, index_name):
+        if self.version_of is None:
+            return None
+        names = index_name if isinstance(index_name, tuple) else (index_name,)
+        return tuple(self.version_of(name) for name in names)
+
+    def _expire(self, now, index_name=None, versions=None):
+        """
+        Drops the entries older than the TTL, and the entries of an index generated from
+        other versions of it. Must be called with the lock held.
+        """
+        expired = [
+            key
+            for key, (_, _, created, entry_versions) in self._entries.items()
+            if now - created > self.ttl
+            or (key[0] == index_name and entry_versions != versions)
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, index_name, query, embed=True):
+        """
+        Looks up a cached answer for a query within an index.
+
+        Args:
+        - index_name (str or tuple): The name of the index the answer was generated from,
+          or a tuple of names for an answer generated from several indexes.
+        - query (str): The rephrased query.
+        - embed (bool or callable, optional): Whether the query may be embedded for semantic matching,
+          or a function returning its embedding (or None), e.g. the one computed for retrieval. It is
+          only called when there are candidates to compare. When False, only an exact match is a hit.
+          Defaults to True.
+
+        Returns:
+        - tuple: The cached answer (or None on a miss) and the query embedding if one was computed,
+          which can be passed back to `store` to avoid embedding the query twice.
+        """
+        key = (index_name, self._hash(query))
+        versions = self._versions(index_name)
+        with self._lock:
+            self._expire(time.time(), index_name, versions)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[0], entry[1]
+            candidates = [
+                (k, v[1])
+                for k, v in self._entries.items()
+                if k[0] == index_name and v[1] is not None
+            ]
+
+        if not candidates or self.threshold > 1 or not embed:
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        vector = embed() if callable(embed) else None
+        vector = self._embed(query) if vector is None else self.normalize(vector)
+        scores = np.stack([v for _, v in candidates]) @ vector
+        best = int(np.argmax(scores))
+        with self._lock:
+            if scores[best] >= self.threshold:
+                entry = self._entries.get(candidates[best][0])
+                if entry is not None:
+                    self._entries.move_to_end(candidates[best][0])
+                    self.semantic_hits += 1
+                    return entry[0], vector
+            self.misses += 1
+        return None, vector
+
+    def store(self, index_name, query, answer, vector=None, embed=True):
+        """
+        Caches the answer to a query within an index.
+
+        Args:
+        - index_name (str or tuple): The name of the index the answer was generated from,
+          or a tuple of names for an answer generated from several indexes.
+        - query (str): The rephrased query.
+        - answer (str): The generated answer.
+        - vector (numpy.ndarray, optional): The query embedding returned by `lookup`.
+        - embed (bool, optional): Whether to embed the query if no vector is given. Without a vector
+          the answer is only matched exactly. Defaults to True.
+        """
+        if vector is None and embed and self.threshold <= 1:
+            vector = self._embed(query)
+        key = (index_name, self._hash(query))
+        versions = self._versions(index_name)
+        with self._lock:
+            self._entries[key] = (answer, vector, time.time(), versions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, index_name):
+        """
+        Drops every cached answer for an index, e.g. after it has been re-uploaded,
+        including answers generated from several indexes at once.
+
+        Args:
+        - index_name (str): The name of the index.
+        """
+        with self._lock:
+            for key in [
+                k
+                for k in self._entries
+                if k[0] == index_name
+                or (isinstance(k[0], tuple) and index_name in k[0])
+            ]:
+                del self._entries[key]
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+        - dict: The number of exact hits, semantic hits, misses, the hit rate and the number of cached answers.
+        """
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            hits = self.exact_hits + self.semantic_hits
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,152 @@
+from collections import Counter, defaultdict
+import heapq
+import json
+import math
+import re
+
+# Keeps codes such as "MF-1024" or "v2.1" together as single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text):
+    """
+    Splits a text into lowercase terms.
+
+    Args:
+    - text (str): The text to tokenize.
+
+    Returns:
+    - list: The terms of the text.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    A compact in-memory inverted index scoring chunks with Okapi BM25, used for
+    lexical retrieval without any embedding call.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        """
+        Initializes an empty BM25Index.
+
+        Args:
+        - k1 (float, optional): The term frequency saturation parameter. Defaults to 1.5.
+        - b (float, optional): The document length normalization parameter. Defaults to 0.75.
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {docstore id: term frequency}
+        self.lengths = {}  # docstore id -> number of terms
+        self.total_length = 0
+
+    def add(self, ids, texts):
+        """
+        Adds chunks to the index.
+
+        Args:
+        - ids (list): The docstore IDs of the chunks.
+        - texts (list): The text of each chunk.
+        """
+        for doc_id, text in zip(ids, texts):
+            terms = tokenize(text)
+            for term, count in Counter(terms).items():
+                self.postings[term][doc_id] = count
+            self.lengths[doc_id] = len(terms)
+            self.total_length += len(terms)
+
+    def remove(self, ids, texts):
+        """
+        Removes chunks from the index.
+
+        Args:
+        - ids (list): The docstore IDs of the chunks.
+        - texts (list): The text of each chunk, used to find its postings.
+        """
+        for doc_id, text in zip(ids, texts):
+            for term in set(tokenize(text)):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self.postings[term]
+            self.total_length -= self.lengths.pop(doc_id, 0)
+
+    def search(self, query, k=3):
+        """
+        Returns the chunks with the highest BM25 score for a query.
+
+        Args:
+        - query (str): The query.
+        - k (int, optional): The number of chunks to return. Defaults to 3.
+
+        Returns:
+        - list: (docstore id, score) tuples, best first.
+        """
+        n = len(self.lengths)
+        if not n:
+            return []
+        average_length = self.total_length / n
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self.lengths[doc_id] / average_length
+                )
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path):
+        """
+        Saves the index as JSON, with the docstore IDs stored once and referenced by position.
+
+        Args:
+        - path (str): The path of the file to write.
+        """
+        ids = list(self.lengths)
+        positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "ids": ids,
+            "lengths": [self.lengths[doc_id] for doc_id in ids],
+            # term -> flat [position, tf, position, tf, ...] list
+            "postings": {
+                term: [
+                    value
+                    for doc_id, tf in postings.items()
+                    for value in (positions[doc_id], tf)
+                ]
+                for term, postings in self.postings.items()
+            },
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved with `save`.
+
+        Args:
+        - path (str): The path of the saved index.
+
+        Returns:
+        - BM25Index: The loaded index.
+        """
+        with open(path, "r") as f:
+            data = json.load(f)
+        index = cls(data["k1"], data["b"])
+        ids = data["ids"]
+        index.lengths = dict(zip(ids, data["lengths"]))
+        index.total_length = sum(data["lengths"])
+        for term, flat in data["postings"].items():
+            index.postings[term] = {
+                ids[flat[i]]: flat[i + 1] for i in range(0, len(flat), 2)
+            }
+        return index
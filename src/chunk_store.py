@@ -0,0 +1,153 @@
+from collections.abc import Mapping
+import json
+import os
+import sqlite3
+import threading
+
+
+class ChunkStore:
+    """
+    A read-only docstore over the chunks of a saved index, kept in SQLite instead of a
+    pickle. Each row holds the FAISS position, docstore ID, text and JSON metadata of a
+    chunk, and chunks are fetched lazily by ID, so loading an index reads none of them.
+    The file is never modified once written, so it is opened immutable and memory-mapped,
+    and processes serving the same index share it in the page cache.
+    """
+
+    def __init__(self, path):
+        """
+        Opens a chunk store written with `write`.
+
+        Args:
+        - path (str): The path to the SQLite database.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False
+        )
+        self._conn.execute(
+            "PRAGMA mmap_size = %d"
+            % int(os.environ.get("CHUNK_STORE_MMAP_SIZE", "1073741824"))
+        )
+
+    @staticmethod
+    def write(path, docstore, index_to_docstore_id):
+        """
+        Writes the chunks of an index to a new chunk store, atomically replacing any existing file.
+
+        Args:
+        - path (str): The path to the SQLite database.
+        - docstore (Docstore): The docstore holding the chunks.
+        - index_to_docstore_id (dict): The docstore ID of each FAISS position.
+        """
+
+        def rows():
+            for position, docstore_id in sorted(index_to_docstore_id.items()):
+                doc = docstore.search(docstore_id)
+                metadata = json.dumps(doc.metadata, default=str)
+                yield position, docstore_id, doc.page_content, metadata
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute(
+                "CREATE TABLE chunks (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, "
+                "page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows())
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+
+    def _document(self, page_content, metadata):
+        from langchain_core.documents import Document
+
+        return Document(page_content=page_content, metadata=json.loads(metadata))
+
+    def search(self, search):
+        """
+        Fetches a chunk by its docstore ID.
+
+        Args:
+        - search (str): The docstore ID.
+
+        Returns:
+        - Document or str: The chunk, or an error message if the ID is unknown, like InMemoryDocstore.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_content, metadata FROM chunks WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return self._document(*row)
+
+    def index_to_docstore_id(self):
+        """
+        Returns a read-only mapping from FAISS positions to docstore IDs backed by the store.
+
+        Returns:
+        - Mapping: The docstore ID of each FAISS position.
+        """
+        return ChunkIds(self)
+
+    def load(self):
+        """
+        Reads every chunk into memory, for an index that is going to be modified.
+
+        Returns:
+        - tuple: An InMemoryDocstore with the chunks, and a dict of the docstore ID of each FAISS position.
+        """
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, id, page_content, metadata FROM chunks ORDER BY position"
+            ).fetchall()
+        docstore = InMemoryDocstore(
+            {
+                docstore_id: self._document(page_content, metadata)
+                for _, docstore_id, page_content, metadata in rows
+            }
+        )
+        return docstore, {position: docstore_id for position, docstore_id, _, _ in rows}
+
+
+class ChunkIds(Mapping):
+    """
+    The docstore ID of each FAISS position of a ChunkStore, looked up on access.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, position):
+        with self.store._lock:
+            row = self.store._conn.execute(
+                "SELECT id FROM chunks WHERE position = ?", (int(position),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __len__(self):
+        with self.store._lock:
+            return self.store._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def __iter__(self):
+        return (position for position, _ in self.items())
+
+    def items(self):
+        with self.store._lock:
+            rows = self.store._conn.execute(
+                "SELECT position, id FROM chunks ORDER BY position"
+            ).fetchall()
+        return rows
+
+    def values(self):
+        return [docstore_id for _, docstore_id in self.items()]
@@ -0,0 +1,199 @@
+import os
+import threading
+
+# Chunks overlap by up to 128 tokens, so a shorter shared run is a coincidence
+MIN_OVERLAP_CHARS = 32
+PASSAGE_SEPARATOR = "\n\n---\n\n"
+
+
+class ContextBuilder:
+    """
+    Assembles the context of the QA prompt from retrieved chunks: chunks of the same
+    document that overlap are merged, metadata is dropped, and the passages are packed
+    in relevance order into a token budget.
+    """
+
+    def __init__(self, max_tokens=None, encoding=None):
+        """
+        Initializes the ContextBuilder.
+
+        Args:
+        - max_tokens (int, optional): The token budget of the context. Defaults to the
+          CONTEXT_MAX_TOKENS environment variable, or 2048.
+        - encoding (str, optional): The tiktoken encoding used to count tokens. Defaults to the
+          CONTEXT_ENCODING environment variable, or "cl100k_base". When tiktoken is unavailable
+          tokens are estimated as 4 characters each.
+        """
+        if max_tokens is None:
+            max_tokens = int(os.environ.get("CONTEXT_MAX_TOKENS", "2048"))
+        if encoding is None:
+            encoding = os.environ.get("CONTEXT_ENCODING", "cl100k_base")
+        self.max_tokens = max_tokens
+        self.encoding = encoding
+        self._encoder = None
+        self._encoder_loaded = False
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.last_prompt_tokens = 0
+        self.chunks_merged = 0
+        self.chunks_dropped = 0
+
+    def _get_encoder(self):
+        """
+        Loads the tiktoken encoding once. Returns None if it cannot be loaded, e.g. offline.
+        """
+        if not self._encoder_loaded:
+            with self._lock:
+                if not self._encoder_loaded:
+                    try:
+                        import tiktoken
+
+                        self._encoder = tiktoken.get_encoding(self.encoding)
+                    except Exception as e:
+                        print(f"Error loading tokenizer, estimating tokens: {e}")
+                    self._encoder_loaded = True
+        return self._encoder
+
+    def count_tokens(self, text):
+        """
+        Counts the tokens of a text.
+
+        Args:
+        - text (str): The text.
+
+        Returns:
+        - int: The number of tokens.
+        """
+        encoder = self._get_encoder()
+        if encoder is None:
+            return (len(text) + 3) // 4
+        return len(encoder.encode(text, disallowed_special=()))
+
+    def _truncate(self, text, max_tokens):
+        encoder = self._get_encoder()
+        if encoder is None:
+            return text[: max_tokens * 4]
+        return encoder.decode(encoder.encode(text, disallowed_special=())[:max_tokens])
+
+    @staticmethod
+    def _merge(first, second):
+        """
+        Merges two texts when the end of the first is the start of the second.
+        Returns None if they do not overlap.
+        """
+        probe = second[:MIN_OVERLAP_CHARS]
+        if len(probe) < MIN_OVERLAP_CHARS:
+            return None
+        start = first.find(probe)
+        while start != -1:
+            if second.startswith(first[start:]):
+                return first + second[len(first) - start :]
+            start = first.find(probe, start + 1)
+        return None
+
+    @staticmethod
+    def _source(doc):
+        metadata = doc.metadata or {}
+        return (
+            metadata.get("index_name"),
+            metadata.get("doc_id") or metadata.get("source"),
+        )
+
+    def merge_chunks(self, docs):
+        """
+        Merges overlapping chunks of the same document and drops duplicates, keeping the
+        passages in the order of their most relevant chunk.
+
+        Args:
+        - docs (list): The retrieved documents, most relevant first.
+
+        Returns:
+        - list: The passage texts.
+        """
+        passages = []  # [source, text]
+        merged = 0
+        for doc in docs:
+            text = doc.page_content.strip()
+            source = self._source(doc)
+            for passage in passages:
+                if passage[0] != source:
+                    continue
+                if text in passage[1]:
+                    combined = passage[1]
+                else:
+                    combined = self._merge(passage[1], text) or self._merge(
+                        text, passage[1]
+                    )
+                if combined is not None:
+                    passage[1] = combined
+                    merged += 1
+                    break
+            else:
+                passages.append([source, text])
+        with self._lock:
+            self.chunks_merged += merged
+        return [text for _, text in passages]
+
+    def build(self, docs):
+        """
+        Builds the context text from the retrieved documents within the token budget.
+        The passage that crosses the budget is truncated and the ones after it are dropped.
+
+        Args:
+        - docs (list or str): The retrieved documents, most relevant first. A string is used as is.
+
+        Returns:
+        - str: The context.
+        """
+        if isinstance(docs, str):
+            return docs
+        packed = []
+        used = 0
+        separator_tokens = self.count_tokens(PASSAGE_SEPARATOR)
+        passages = self.merge_chunks(docs)
+        for i, passage in enumerate(passages):
+            budget = self.max_tokens - used - (separator_tokens if packed else 0)
+            tokens = self.count_tokens(passage)
+            if tokens > budget:
+                if budget > 0:
+                    packed.append(self._truncate(passage, budget))
+                with self._lock:
+                    self.chunks_dropped += len(passages) - i - (1 if budget > 0 else 0)
+                break
+            packed.append(passage)
+            used += tokens + (separator_tokens if len(packed) > 1 else 0)
+        return PASSAGE_SEPARATOR.join(packed)
+
+    def record(self, prompt_tokens):
+        """
+        Records the size of a prompt sent to the LLM.
+
+        Args:
+        - prompt_tokens (int): The number of tokens of the prompt.
+        """
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.last_prompt_tokens = prompt_tokens
+
+    def stats(self):
+        """
+        Returns the context counters.
+
+        Returns:
+        - dict: The number of prompts built, their average and last size in tokens, the number of
+          merged and dropped chunks, and the token budget.
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "avg_prompt_tokens": (
+                    self.prompt_tokens / self.requests if self.requests else 0.0
+                ),
+                "last_prompt_tokens": self.last_prompt_tokens,
+                "chunks_merged": self.chunks_merged,
+                "chunks_dropped": self.chunks_dropped,
+                "max_tokens": self.max_tokens,
+                "tokenizer": self.encoding if self._encoder is not None else "estimate",
+            }
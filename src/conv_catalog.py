@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class ConvCatalog:
+    """
+    An index of the stored conversations in SQLite, with the creation time, last update
+    time, message count and file size of each. Listing is a keyset-paginated range scan
+    over (updated_at, id), so its cost depends on the page size only.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes the ConvCatalog.
+
+        Args:
+        - path (str): The path to the SQLite database.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "id TEXT PRIMARY KEY, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "messages INTEGER NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS conversations_updated "
+            "ON conversations (updated_at, id)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _row(row):
+        id, created_at, updated_at, messages, size = row
+        return {
+            "id": id,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "messages": messages,
+            "size": size,
+        }
+
+    @staticmethod
+    def _encode_cursor(entry):
+        return f"{entry['updated_at']!r}|{entry['id']}"
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        updated_at, id = cursor.split("|", 1)
+        return float(updated_at), id
+
+    def is_empty(self):
+        """
+        Returns whether no conversation has been recorded.
+
+        Returns:
+        - bool: True if the catalog is empty.
+        """
+        with self._lock:
+            return (
+                self._conn.execute("SELECT 1 FROM conversations LIMIT 1").fetchone()
+                is None
+            )
+
+    def touch(self, id, messages, size, updated_at=None):
+        """
+        Records that messages were appended to a conversation.
+
+        Args:
+        - id (str): The ID of the conversation.
+        - messages (int): The number of appended messages.
+        - size (int): The size of the conversation file after the append.
+        - updated_at (float, optional): The time of the append. Defaults to now.
+        """
+        if updated_at is None:
+            updated_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversations (id, created_at, updated_at, messages, size) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                "updated_at = excluded.updated_at, "
+                "messages = conversations.messages + excluded.messages, "
+                "size = excluded.size",
+                (id, updated_at, updated_at, messages, size),
+            )
+            self._conn.commit()
+
+    def put_many(self, entries):
+        """
+        Records conversations with known metadata, e.g. when indexing existing files.
+
+        Args:
+        - entries (list): Dictionaries with the id, created_at, updated_at, messages and size of a conversation.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO conversations "
+                "(id, created_at, updated_at, messages, size) "
+                "VALUES (:id, :created_at, :updated_at, :messages, :size)",
+                entries,
+            )
+            self._conn.commit()
+
+    def get(self, id):
+        """
+        Returns the metadata of a conversation.
+
+        Args:
+        - id (str): The ID of the conversation.
+
+        Returns:
+        - dict or None: The metadata, or None if the conversation is not recorded.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, created_at, updated_at, messages, size "
+                "FROM conversations WHERE id = ?",
+                (id,),
+            ).fetchone()
+        return self._row(row) if row else None
+
+    def list(self, cursor=None, limit=50):
+        """
+        Lists conversations, most recently updated first.
+
+        Args:
+        - cursor (str, optional): The next_cursor returned with the previous page.
+        - limit (int, optional): The maximum number of conversations to list. Defaults to 50.
+
+        Returns:
+        - tuple: The list of conversation metadata, and the cursor of the next page or None.
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        query = "SELECT id, created_at, updated_at, messages, size FROM conversations"
+        params = []
+        if cursor:
+            updated_at, id = self._decode_cursor(cursor)
+            query += " WHERE updated_at < ? OR (updated_at = ? AND id < ?)"
+            params += [updated_at, updated_at, id]
+        query += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        # Fetch one more row to know whether there is a next page
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        entries = [self._row(row) for row in rows[:limit]]
+        next_cursor = self._encode_cursor(entries[-1]) if len(rows) > limit else None
+        return entries, next_cursor
+
+    def updated_before(self, cutoff, limit=500):
+        """
+        Returns the conversations last updated before a time, oldest first.
+
+        Args:
+        - cutoff (float): The time, in seconds since the epoch.
+        - limit (int, optional): The maximum number of conversations to return. Defaults to 500.
+
+        Returns:
+        - list: The metadata of the conversations.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created_at, updated_at, messages, size FROM conversations "
+                "WHERE updated_at < ? ORDER BY updated_at, id LIMIT ?",
+                (cutoff, limit),
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def remove(self, id):
+        """
+        Removes a conversation from the catalog.
+
+        Args:
+        - id (str): The ID of the conversation.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE id = ?", (id,))
+            self._conn.commit()
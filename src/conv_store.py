@@ -0,0 +1,335 @@
+from collections import OrderedDict, deque
+import json
+import os
+import re
+import threading
+import time
+from src.conv_catalog import ConvCatalog
+
+
+class ConvStore:
+    """
+    An append-only conversation store. Each conversation is a JSON Lines file
+    with one message per line, and the last few messages of recently active
+    conversations are kept in a bounded in-memory cache. Cached tails are
+    validated against the file size, so appends from other processes are seen.
+    A ConvCatalog indexes the conversations for listing and retention.
+    """
+
+    # The number of locks serializing the writes to a conversation file
+    LOCK_STRIPES = 64
+    # Conversation IDs become file names in conv_folder, so they must stay a single path component
+    ID_PATTERN = re.compile(r"[\w-][\w.-]{0,127}")
+
+    def __init__(
+        self, conv_folder="conv", tail_size=None, max_sessions=None, catalog_path=None
+    ):
+        """
+        Initializes the ConvStore.
+
+        Args:
+        - conv_folder (str, optional): The folder holding the conversation files. Defaults to "conv".
+        - tail_size (int, optional): The number of messages cached per conversation. Defaults to the
+          CONV_TAIL_SIZE environment variable, or 10.
+        - max_sessions (int, optional): The number of conversations kept in the cache. Defaults to the
+          CONV_CACHE_SESSIONS environment variable, or 1024.
+        - catalog_path (str, optional): The path to the SQLite conversation catalog. Defaults to the
+          CONV_CATALOG_PATH environment variable, or "catalog.db" inside conv_folder.
+        """
+        if tail_size is None:
+            tail_size = int(os.environ.get("CONV_TAIL_SIZE", "10"))
+        if max_sessions is None:
+            max_sessions = int(os.environ.get("CONV_CACHE_SESSIONS", "1024"))
+        self.conv_folder = conv_folder
+        self.tail_size = tail_size
+        self.max_sessions = max_sessions
+        # conversation id -> (deque of recent messages, file size)
+        self._tails = OrderedDict()
+        self._lock = threading.Lock()
+        # Striped per-conversation locks, so their number does not grow with the conversations
+        self._id_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        if catalog_path is None:
+            catalog_path = os.environ.get(
+                "CONV_CATALOG_PATH", os.path.join(conv_folder, "catalog.db")
+            )
+        self.catalog = ConvCatalog(catalog_path)
+        if self.catalog.is_empty():
+            self._index_existing()
+
+    @classmethod
+    def validate_id(cls, id):
+        """
+        Checks that a conversation ID is safe to use as a file name in conv_folder: 1 to 128
+        letters, digits, underscores, hyphens and dots, not starting with a dot.
+
+        Args:
+        - id (str): The ID of the conversation.
+
+        Returns:
+        - str: The validated ID.
+
+        Raises:
+        - ValueError: If the ID is not a valid conversation ID.
+        """
+        if not isinstance(id, str) or not cls.ID_PATTERN.fullmatch(id):
+            raise ValueError(f"Invalid conversation id: {id!r}")
+        return id
+
+    def _path(self, id):
+        return os.path.join(self.conv_folder, self.validate_id(id) + ".jsonl")
+
+    def _legacy_path(self, id):
+        return os.path.join(self.conv_folder, self.validate_id(id) + ".json")
+
+    def _index_existing(self):
+        """
+        Adds the conversation files saved before the catalog existed to the catalog.
+        """
+        entries = []
+        try:
+            files = list(os.scandir(self.conv_folder))
+        except FileNotFoundError:
+            return
+        for entry in files:
+            id, extension = os.path.splitext(entry.name)
+            if extension not in (".jsonl", ".json") or not entry.is_file():
+                continue
+            if not self.ID_PATTERN.fullmatch(id):
+                continue
+            try:
+                with open(entry.path, "rb") as f:
+                    if extension == ".json":
+                        messages = len(json.load(f))
+                    else:
+                        messages = sum(1 for line in f if line.strip())
+                stat = entry.stat()
+            except (OSError, ValueError) as e:
+                print(f"Error indexing conversation {entry.name}: {e}")
+                continue
+            entries.append(
+                {
+                    "id": id,
+                    "created_at": stat.st_mtime,
+                    "updated_at": stat.st_mtime,
+                    "messages": messages,
+                    "size": stat.st_size,
+                }
+            )
+        if entries:
+            self.catalog.put_many(entries)
+
+    def _id_lock(self, id):
+        return self._id_locks[hash(id) % len(self._id_locks)]
+
+    def _file_size(self, id):
+        try:
+            return os.stat(self._path(id)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _cache_tail(self, id, messages, size):
+        with self._lock:
+            self._tails[id] = (deque(messages, maxlen=self.tail_size), size)
+            self._tails.move_to_end(id)
+            while len(self._tails) > self.max_sessions:
+                self._tails.popitem(last=False)
+
+    def _migrate_legacy(self, id):
+        """
+        Converts a conversation saved in the old whole-file JSON format to JSON Lines.
+
+        Args:
+        - id (str): The ID of the conversation.
+        """
+        legacy_path = self._legacy_path(id)
+        if not os.path.exists(legacy_path) or os.path.exists(self._path(id)):
+            return
+        with open(legacy_path, "r") as f:
+            messages = json.load(f)
+        tmp_path = self._path(id) + ".tmp"
+        with open(tmp_path, "w") as f:
+            for message in messages:
+                f.write(json.dumps(message) + "\n")
+        os.replace(tmp_path, self._path(id))
+        os.remove(legacy_path)
+
+    def _read_tail(self, id, n):
+        """
+        Reads the last n messages of a conversation file by scanning backwards from its end.
+
+        Args:
+        - id (str): The ID of the conversation.
+        - n (int): The number of messages to read.
+
+        Returns:
+        - list: The last n messages, oldest first. Empty if the conversation does not exist.
+        """
+        try:
+            f = open(self._path(id), "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            block_size = 4096
+            # n messages need n + 1 newlines unless the whole file has been read
+            while position > 0 and data.count(b"\n") <= n:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+        lines = [line for line in data.splitlines() if line.strip()]
+        if position > 0:
+            lines = lines[1:]  # The first line may be cut in half
+        return [json.loads(line) for line in lines[-n:]]
+
+    def tail(self, id, n=2):
+        """
+        Returns the last n messages of a conversation.
+
+        Args:
+        - id (str): The ID of the conversation.
+        - n (int, optional): The number of messages to return. Defaults to 2.
+
+        Returns:
+        - list: The last n messages, oldest first. Empty if the conversation does not exist.
+        """
+        if n < 1:
+            raise ValueError("limit must be at least 1")
+        size = self._file_size(id)
+        with self._lock:
+            entry = self._tails.get(id)
+            if entry is not None and entry[1] == size:
+                cached = entry[0]
+                if n <= len(cached) or len(cached) < cached.maxlen:
+                    self._tails.move_to_end(id)
+                    return list(cached)[-n:]
+
+        with self._id_lock(id):
+            self._migrate_legacy(id)
+            size = self._file_size(id)
+            messages = self._read_tail(id, max(n, self.tail_size))
+            if messages:
+                self._cache_tail(id, messages, size)
+        return messages[-n:]
+
+    def read_all(self, id):
+        """
+        Returns the full history of a conversation.
+
+        Args:
+        - id (str): The ID of the conversation.
+
+        Returns:
+        - list: Every message of the conversation, oldest first.
+        """
+        with self._id_lock(id):
+            self._migrate_legacy(id)
+            try:
+                with open(self._path(id), "r") as f:
+                    return [json.loads(line) for line in f if line.strip()]
+            except FileNotFoundError:
+                return []
+
+    def append(self, id, messages):
+        """
+        Appends messages to a conversation without rewriting its earlier turns.
+
+        Args:
+        - id (str): The ID of the conversation.
+        - messages (list): The messages to append, each a dictionary containing 'role' and 'content'.
+        """
+        if not messages:
+            return
+        payload = "".join(json.dumps(message) + "\n" for message in messages)
+        with self._id_lock(id):
+            os.makedirs(self.conv_folder, exist_ok=True)
+            self._migrate_legacy(id)
+            # A single O_APPEND write keeps a turn contiguous even across processes
+            data = payload.encode("utf-8")
+            fd = os.open(self._path(id), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, data)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            self.catalog.touch(id, len(messages), size)
+            with self._lock:
+                entry = self._tails.get(id)
+                if entry is not None and entry[1] + len(data) == size:
+                    entry[0].extend(messages)
+                    self._tails[id] = (entry[0], size)
+                    self._tails.move_to_end(id)
+                else:
+                    # Another writer appended in between; reload on the next read
+                    self._tails.pop(id, None)
+
+    def list(self, cursor=None, limit=50):
+        """
+        Lists conversations from the catalog, most recently updated first.
+
+        Args:
+        - cursor (str, optional): The next_cursor returned with the previous page.
+        - limit (int, optional): The maximum number of conversations to list. Defaults to 50.
+
+        Returns:
+        - tuple: The list of conversation metadata, and the cursor of the next page or None.
+        """
+        return self.catalog.list(cursor, limit)
+
+    def delete(self, id, updated_before=None):
+        """
+        Deletes a conversation.
+
+        Args:
+        - id (str): The ID of the conversation.
+        - updated_before (float, optional): Only delete the conversation if it was last updated
+          before this time, checked while holding its lock.
+
+        Returns:
+        - bool: True if the conversation was deleted.
+
+        Raises:
+        - ValueError: If the ID is not a valid conversation ID.
+        """
+        self.validate_id(id)
+        with self._id_lock(id):
+            if updated_before is not None:
+                entry = self.catalog.get(id)
+                if entry is None or entry["updated_at"] >= updated_before:
+                    return False
+            for path in (self._path(id), self._legacy_path(id)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.catalog.remove(id)
+            with self._lock:
+                self._tails.pop(id, None)
+            return True
+
+    def compact(self, max_age, batch_size=500):
+        """
+        Deletes the conversations that have not been updated within the retention period.
+
+        Args:
+        - max_age (float): The retention period in seconds.
+        - batch_size (int, optional): The number of conversations looked up at a time. Defaults to 500.
+
+        Returns:
+        - int: The number of deleted conversations.
+        """
+        cutoff = time.time() - max_age
+        deleted = 0
+        while True:
+            stale = self.catalog.updated_before(cutoff, batch_size)
+            for entry in stale:
+                if not self.ID_PATTERN.fullmatch(entry["id"]):
+                    # Not a file name in conv_folder, so only the catalog entry is dropped
+                    self.catalog.remove(entry["id"])
+                    continue
+                # Conversations appended to in the meantime are kept
+                deleted += self.delete(entry["id"], updated_before=cutoff)
+            if len(stale) < batch_size:
+                return deleted
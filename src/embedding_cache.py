@@ -0,0 +1,155 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    A persistent, content-addressed cache of chunk embeddings stored in SQLite
+    and keyed by (embedding model, SHA-256 of the chunk text).
+    """
+
+    def __init__(self, path=None):
+        """
+        Initializes the EmbeddingCache.
+
+        Args:
+        - path (str, optional): The path to the SQLite database. Defaults to the
+          EMBEDDING_CACHE_PATH environment variable, or "embedding_cache/embeddings.db".
+        """
+        if path is None:
+            path = os.environ.get(
+                "EMBEDDING_CACHE_PATH", "embedding_cache/embeddings.db"
+            )
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+        self.reused = 0
+        self.embedded = 0
+
+    @staticmethod
+    def model_name(embedding_function):
+        """
+        Returns the name identifying the model behind an embedding function.
+
+        Args:
+        - embedding_function (Embeddings): The embedding function.
+
+        Returns:
+        - str: The model name.
+        """
+        return getattr(embedding_function, "model", None) or getattr(
+            embedding_function, "model_name", type(embedding_function).__name__
+        )
+
+    @staticmethod
+    def _hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model, texts):
+        """
+        Looks up the cached embeddings of several texts.
+
+        Args:
+        - model (str): The embedding model name.
+        - texts (list): The texts to look up.
+
+        Returns:
+        - list: The embedding of each text, or None where it is not cached.
+        """
+        hashes = [self._hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = list(set(hashes[start : start + 500]))
+                rows = self._conn.execute(
+                    "SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN (%s)"
+                    % ",".join("?" * len(batch)),
+                    [model, *batch],
+                ).fetchall()
+                found.update(rows)
+        return [
+            np.frombuffer(found[h], dtype=np.float32).tolist() if h in found else None
+            for h in hashes
+        ]
+
+    def put_many(self, model, texts, vectors):
+        """
+        Stores the embeddings of several texts.
+
+        Args:
+        - model (str): The embedding model name.
+        - texts (list): The embedded texts.
+        - vectors (list): The embedding of each text.
+        """
+        rows = [
+            (model, self._hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts, embedding_function, embed=None):
+        """
+        Embeds texts, only sending the ones missing from the cache to the embedding function.
+
+        Args:
+        - texts (list): The texts to embed.
+        - embedding_function (Embeddings): The embedding function used for cache misses.
+        - embed (callable, optional): A function taking a list of texts and returning their embeddings,
+          used instead of `embedding_function.embed_documents` for cache misses.
+
+        Returns:
+        - list: The embedding of each text, in input order.
+        """
+        model = self.model_name(embedding_function)
+        if embed is None:
+            embed = embedding_function.embed_documents
+        vectors = self.get_many(model, texts)
+
+        # Embed each distinct missing text once
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(texts[i], []).append(i)
+        if missing:
+            missing_texts = list(missing)
+            new_vectors = embed(missing_texts)
+            self.put_many(model, missing_texts, new_vectors)
+            for text, vector in zip(missing_texts, new_vectors):
+                for i in missing[text]:
+                    vectors[i] = list(vector)
+
+        reused = len(texts) - sum(len(v) for v in missing.values())
+        with self._lock:
+            self.embedded += len(missing)
+            self.reused += reused
+        print(f"Embeddings: {reused} reused, {len(missing)} new")
+        return vectors
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+        - dict: The number of chunk embeddings reused from the cache and newly computed.
+        """
+        with self._lock:
+            return {"reused": self.reused, "embedded": self.embedded}
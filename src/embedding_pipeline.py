@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import threading
+import time
+
+
+class RateLimitError(Exception):
+    """
+    Raised when an embedding batch is still rate limited after all retries.
+    """
+
+
+class EmbeddingPipeline:
+    """
+    Embeds texts in fixed-size batches with bounded parallelism. Concurrency
+    adapts to the provider: it is halved whenever a batch is rate limited
+    (HTTP 429 / quota exhausted) and grows back by one on every success.
+    """
+
+    def __init__(
+        self,
+        batch_size=None,
+        max_workers=None,
+        max_retries=None,
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        """
+        Initializes the EmbeddingPipeline.
+
+        Args:
+        - batch_size (int, optional): The number of texts per request. Defaults to the
+          EMBED_BATCH_SIZE environment variable, or 100.
+        - max_workers (int, optional): The maximum number of concurrent requests. Defaults to the
+          EMBED_MAX_WORKERS environment variable, or 4.
+        - max_retries (int, optional): The number of retries for a rate-limited batch. Defaults to the
+          EMBED_MAX_RETRIES environment variable, or 6.
+        - base_delay (float, optional): The first backoff delay in seconds. Defaults to 1.0.
+        - max_delay (float, optional): The longest backoff delay in seconds. Defaults to 60.0.
+        """
+        if batch_size is None:
+            batch_size = int(os.environ.get("EMBED_BATCH_SIZE", "100"))
+        if max_workers is None:
+            max_workers = int(os.environ.get("EMBED_MAX_WORKERS", "4"))
+        if max_retries is None:
+            max_retries = int(os.environ.get("EMBED_MAX_RETRIES", "6"))
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._limit = max_workers
+        self._active = 0
+        self._condition = threading.Condition()
+        self.batches = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    @staticmethod
+    def is_rate_limit_error(error):
+        """
+        Checks whether an exception signals that the provider is rate limiting us.
+
+        Args:
+        - error (Exception): The exception raised by the embedding function.
+
+        Returns:
+        - bool: True if the request should be retried after backing off.
+        """
+        message = f"{type(error).__name__} {error}".lower()
+        return any(
+            marker in message
+            for marker in (
+                "429",
+                "resourceexhausted",
+                "resource exhausted",
+                "quota",
+                "rate limit",
+            )
+        )
+
+    def _acquire(self):
+        with self._condition:
+            while self._active >= self._limit:
+                self._condition.wait()
+            self._active += 1
+
+    def _release(self, rate_limited):
+        with self._condition:
+            self._active -= 1
+            if rate_limited:
+                self._limit = max(1, self._limit // 2)
+            else:
+                self._limit = min(self.max_workers, self._limit + 1)
+            self._condition.notify_all()
+
+    def _embed_batch(self, texts, embed):
+        """
+        Embeds one batch, backing off exponentially with jitter while it is rate limited.
+
+        Args:
+        - texts (list): The texts of the batch.
+        - embed (callable): A function taking a list of texts and returning their embeddings.
+
+        Returns:
+        - list: The embedding of each text.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            try:
+                vectors = embed(texts)
+            except Exception as e:
+                self._release(rate_limited=self.is_rate_limit_error(e))
+                if not self.is_rate_limit_error(e):
+                    raise
+                with self._condition:
+                    self.rate_limited += 1
+                    if attempt < self.max_retries:
+                        self.retries += 1
+                if attempt == self.max_retries:
+                    raise RateLimitError(
+                        f"Embedding batch still rate limited: {e}"
+                    ) from e
+                delay = min(self.max_delay, self.base_delay * 2**attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            self._release(rate_limited=False)
+            with self._condition:
+                self.batches += 1
+            return vectors
+
+    def embed(self, texts, embed):
+        """
+        Embeds texts in batches, keeping the input order.
+
+        Args:
+        - texts (list): The texts to embed.
+        - embed (callable): A function taking a list of texts and returning their embeddings,
+          e.g. the `embed_documents` method of an embedding function.
+
+        Returns:
+        - list: The embedding of each text, in input order.
+        """
+        batches = [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if len(batches) <= 1:
+            return [v for batch in batches for v in self._embed_batch(batch, embed)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(
+                lambda batch: self._embed_batch(batch, embed), batches
+            )
+            return [vector for vectors in results for vector in vectors]
+
+    def stats(self):
+        """
+        Returns the pipeline counters.
+
+        Returns:
+        - dict: The number of embedded batches, retries, rate-limited attempts and the current concurrency limit.
+        """
+        with self._condition:
+            return {
+                "batches": self.batches,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "concurrency_limit": self._limit,
+            }
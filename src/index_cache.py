@@ -0,0 +1,198 @@
+from collections import OrderedDict
+import os
+import threading
+from src.metrics import metrics
+
+
+class IndexCache:
+    """
+    A thread-safe LRU cache of loaded FAISS indexes keyed by index name,
+    bounded by an approximate memory budget. Each entry records the version of
+    the index it holds, and is reloaded once a newer version has been published,
+    including by another process.
+    """
+
+    def __init__(
+        self,
+        max_bytes=None,
+        index_folder="faiss_index",
+        resolve_path=None,
+        size_of=None,
+        version_of=None,
+    ):
+        """
+        Initializes the IndexCache.
+
+        Args:
+        - max_bytes (int, optional): The memory budget for cached indexes. Defaults to the
+          INDEX_CACHE_MAX_BYTES environment variable, or 1 GiB.
+        - index_folder (str, optional): The folder holding the saved indexes. Defaults to "faiss_index".
+        - resolve_path (callable, optional): A function taking an index name and returning the folder
+          holding its files. Defaults to the index name inside index_folder.
+        - size_of (callable, optional): A function taking an index name and returning the size of its
+          files if known, e.g. from the index catalog, so they need not be listed.
+        - version_of (callable, optional): A function taking an index name and returning its current
+          version, e.g. from the index catalog. Entries of another version are reloaded.
+        """
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("INDEX_CACHE_MAX_BYTES", str(1 << 30)))
+        self.max_bytes = max_bytes
+        self.index_folder = index_folder
+        self.resolve_path = resolve_path or (
+            lambda name: os.path.join(self.index_folder, name)
+        )
+        self.size_of = size_of
+        self.version_of = version_of
+        # index name -> (index, size in bytes, version)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def estimate_size(self, name):
+        """
+        Estimates the in-memory size of an index from the size of its files on disk.
+
+        Args:
+        - name (str): The name of the index.
+
+        Returns:
+        - int: The estimated size in bytes.
+        """
+        if self.size_of is not None:
+            size = self.size_of(name)
+            if size is not None:
+                return size
+        path = self.resolve_path(name)
+        size = 0
+        try:
+            for entry in os.scandir(path):
+                if entry.is_file():
+                    size += entry.stat().st_size
+        except OSError:
+            pass
+        return size
+
+    def get(self, name, loader):
+        """
+        Returns the cached index for a name, loading it with the given loader on a miss.
+
+        Args:
+        - name (str): The name of the index.
+        - loader (callable): A function taking the index name and returning the loaded index,
+          or None if it cannot be loaded.
+
+        Returns:
+        - FAISS: The loaded index, or None if it could not be loaded.
+        """
+        version = self._current_version(name)
+        with self._lock:
+            index = self._hit(name, version)
+            if index is not None:
+                return index
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # Only one thread loads a given index; the others wait and reuse it
+        with load_lock:
+            with self._lock:
+                index = self._hit(name, version)
+                if index is not None:
+                    return index
+                self.misses += 1
+                metrics.inc("index_cache_lookups_total", result="miss")
+            index = loader(name)
+            if index is not None:
+                # Not cached if a newer version was published while loading
+                self.put(name, index, version=version)
+            return index
+
+    def _current_version(self, name):
+        return self.version_of(name) if self.version_of is not None else None
+
+    def _hit(self, name, version):
+        """
+        Returns the cached index for a name if it is of the given version, dropping it
+        otherwise. Must be called with the lock held.
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        if entry[2] != version:
+            del self._entries[name]
+            self.current_bytes -= entry[1]
+            return None
+        self._entries.move_to_end(name)
+        self.hits += 1
+        metrics.inc("index_cache_lookups_total", result="hit")
+        return entry[0]
+
+    def put(self, name, index, size=None, version=None):
+        """
+        Adds or replaces an index in the cache, evicting the least recently used
+        indexes until the memory budget is respected.
+
+        Args:
+        - name (str): The name of the index.
+        - index (FAISS): The loaded index.
+        - size (int, optional): The size of the index in bytes. Estimated from disk if omitted.
+        - version (str, optional): The version of the index. The index is not cached if it is no
+          longer the current version. Defaults to the current version.
+        """
+        if size is None:
+            size = self.estimate_size(name)
+        current = self._current_version(name)
+        if version is None:
+            version = current
+        elif version != current:
+            return
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[name] = (index, size, version)
+            self.current_bytes += size
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, name):
+        """
+        Removes an index from the cache, e.g. after it has been rewritten on disk.
+
+        Args:
+        - name (str): The name of the index.
+        """
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+
+    def clear(self):
+        """
+        Removes every index from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+        - dict: The number of hits, misses, evictions, cached indexes and cached bytes.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "indexes": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,308 @@
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: updates are only serialized within the process
+    fcntl = None
+
+
+class IndexCatalog:
+    """
+    A persistent catalog of the saved indexes and their metadata (chunk count, size,
+    embedding model, build time), kept in faiss_index/catalog.json and held in memory.
+    Listing indexes reads neither the index folders nor the index files. The file is
+    re-read when another process has changed it, checked at most every refresh_interval seconds.
+    Updates hold an exclusive lock on faiss_index/catalog.lock, so concurrent writers in
+    other processes do not overwrite each other's entries.
+    """
+
+    # The files of the catalog in the index folder, which no index may be named after
+    FILENAME = "catalog.json"
+    LOCK_FILENAME = "catalog.lock"
+
+    def __init__(self, index_folder="faiss_index", refresh_interval=None):
+        """
+        Initializes the IndexCatalog. The catalog is loaded on first use, and rebuilt from
+        the manifests of the saved indexes if the catalog file does not exist yet.
+
+        Args:
+        - index_folder (str, optional): The folder holding the saved indexes. Defaults to "faiss_index".
+        - refresh_interval (float, optional): The number of seconds between checks of the catalog file
+          for changes by other processes. Defaults to the INDEX_CATALOG_REFRESH_SECONDS environment
+          variable, or 5.
+        """
+        if refresh_interval is None:
+            refresh_interval = float(
+                os.environ.get("INDEX_CATALOG_REFRESH_SECONDS", "5")
+            )
+        self.index_folder = index_folder
+        self.path = os.path.join(index_folder, self.FILENAME)
+        self.lock_path = os.path.join(index_folder, self.LOCK_FILENAME)
+        self.refresh_interval = refresh_interval
+        # index name -> metadata
+        self._entries = None
+        self._names = []
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._file_locked = False
+
+    @classmethod
+    def is_reserved(cls, name):
+        """
+        Checks whether a name is taken by the files of the catalog, including the temporary
+        files it is written through.
+
+        Args:
+        - name (str): The name to check.
+
+        Returns:
+        - bool: True if no index may have the name.
+        """
+        return name in (cls.FILENAME, cls.LOCK_FILENAME) or name.startswith(
+            cls.FILENAME + "."
+        )
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Holds the cross-process lock of the catalog file. Must be called with the lock held,
+        and may be nested.
+        """
+        if self._file_locked:
+            yield
+            return
+        os.makedirs(self.index_folder, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            self._file_locked = True
+            try:
+                yield
+            finally:
+                self._file_locked = False
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _folder_size(path):
+        size = 0
+        try:
+            for entry in os.scandir(path):
+                if entry.is_file():
+                    size += entry.stat().st_size
+        except OSError:
+            pass
+        return size
+
+    def _scan(self):
+        """
+        Builds the catalog entries from the index folders and their manifests.
+
+        Returns:
+        - dict: The metadata of every saved index, keyed by index name.
+        """
+        entries = {}
+        if not os.path.isdir(self.index_folder):
+            return entries
+        for folder in os.scandir(self.index_folder):
+            if not folder.is_dir():
+                continue
+            path = folder.path
+            version = None
+            try:
+                with open(os.path.join(path, "CURRENT"), "r") as f:
+                    version = f.read().strip()
+                path = os.path.join(path, version)
+            except FileNotFoundError:
+                pass
+            if not os.path.exists(os.path.join(path, "index.faiss")):
+                continue
+            entry = {}
+            try:
+                with open(os.path.join(path, "manifest.json"), "r") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                pass
+            entry.setdefault("version", version)
+            entry.setdefault("size_bytes", self._folder_size(path))
+            entry.setdefault(
+                "built_at", os.path.getmtime(os.path.join(path, "index.faiss"))
+            )
+            entries[folder.name] = entry
+        return entries
+
+    def _load(self):
+        """
+        Loads the catalog file into memory, or rebuilds it if it does not exist. Must be
+        called with the lock held.
+        """
+        mtime = self._file_mtime()
+        if mtime is None:
+            with self._file_lock():
+                # Another process may have written it while this one waited
+                if self._file_mtime() is None:
+                    entries = self._scan()
+                    self._entries = entries
+                    self._names = sorted(entries)
+                    self._save()
+                    return
+            mtime = self._file_mtime()
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error reading index catalog, rebuilding it: {e}")
+            entries = self._scan()
+        self._entries = entries
+        self._names = sorted(entries)
+        self._mtime = mtime
+
+    def _save(self):
+        """
+        Writes the catalog file atomically. Must be called with the lock held.
+        """
+        os.makedirs(self.index_folder, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+        self._mtime = self._file_mtime()
+
+    def _refresh(self, force=False):
+        """
+        Loads the catalog on first use and reloads it when the file was changed by another
+        process. Must be called with the lock held.
+
+        Args:
+        - force (bool, optional): Whether to check the file regardless of refresh_interval.
+        """
+        now = time.monotonic()
+        if self._entries is None:
+            self._load()
+        elif force or now - self._checked >= self.refresh_interval:
+            if self._file_mtime() != self._mtime:
+                self._load()
+        else:
+            return
+        self._checked = now
+
+    def put(self, name, metadata):
+        """
+        Records the metadata of a saved index.
+
+        Args:
+        - name (str): The name of the index.
+        - metadata (dict): The metadata of the index, i.e. its manifest.
+        """
+        with self._lock, self._file_lock():
+            # Re-read the file, as another process may have written it within the mtime
+            # granularity, so its entries are not overwritten
+            self._load()
+            self._checked = time.monotonic()
+            if name not in self._entries:
+                self._names.insert(bisect_left(self._names, name), name)
+            self._entries[name] = dict(metadata)
+            self._save()
+
+    def remove(self, name):
+        """
+        Removes an index from the catalog, e.g. when its folder was deleted.
+
+        Args:
+        - name (str): The name of the index.
+
+        Returns:
+        - bool: True if the index was in the catalog.
+        """
+        with self._lock, self._file_lock():
+            # Re-read the file, so the entries written by other processes are kept
+            self._load()
+            self._checked = time.monotonic()
+            if name not in self._entries:
+                return False
+            del self._entries[name]
+            del self._names[bisect_left(self._names, name)]
+            self._save()
+            return True
+
+    def get(self, name):
+        """
+        Returns the metadata of an index.
+
+        Args:
+        - name (str): The name of the index.
+
+        Returns:
+        - dict or None: The metadata, or None if the index is not in the catalog.
+        """
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(name)
+            return dict(entry) if entry is not None else None
+
+    def size_of(self, name):
+        """
+        Returns the size of the files of an index, as recorded when it was saved.
+
+        Args:
+        - name (str): The name of the index.
+
+        Returns:
+        - int or None: The size in bytes, or None if it is not known.
+        """
+        entry = self.get(name)
+        return entry.get("size_bytes") if entry else None
+
+    def version_of(self, name):
+        """
+        Returns the current version of an index, as recorded when it was saved.
+
+        Args:
+        - name (str): The name of the index.
+
+        Returns:
+        - str or None: The version, or None if it is not known.
+        """
+        entry = self.get(name)
+        return entry.get("version") if entry else None
+
+    def list(self, prefix="", cursor=None, limit=None):
+        """
+        Lists the indexes in name order.
+
+        Args:
+        - prefix (str, optional): Only list the indexes whose name starts with this prefix.
+        - cursor (str, optional): Only list the indexes after this name, i.e. the last name of the previous page.
+        - limit (int, optional): The maximum number of indexes to list. Defaults to all.
+
+        Returns:
+        - tuple: The list of (name, metadata) pairs, and the cursor of the next page or None.
+        """
+        with self._lock:
+            self._refresh()
+            names = self._names
+            start = bisect_left(names, prefix)
+            if cursor is not None:
+                start = max(start, bisect_right(names, cursor))
+            end = bisect_left(names, prefix + "\U0010ffff") if prefix else len(names)
+            stop = end if limit is None else min(end, start + limit)
+            page = [(name, dict(self._entries[name])) for name in names[start:stop]]
+            next_cursor = page[-1][0] if page and stop < end else None
+            return page, next_cursor
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._names)
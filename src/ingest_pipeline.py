@@ -0,0 +1,194 @@
+from queue import Empty, Full, Queue
+import os
+import threading
+import time
+from src.metrics import metrics
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """
+    Raised inside a stage thread when the pipeline is shutting down.
+    """
+
+
+class IngestPipeline:
+    """
+    Runs the stages of document ingestion in their own threads, connected by bounded
+    queues, so parsing, chunking and embedding overlap while only a few batches are
+    held between stages. Every stage yields lists of items; the number of items and the
+    time each stage spent working (excluding waiting on its neighbours) are counted, and
+    the working time of each stage is observed in stage_duration_seconds when it ends.
+    """
+
+    def __init__(self, queue_size=None, poll_interval=0.1):
+        """
+        Initializes the IngestPipeline.
+
+        Args:
+        - queue_size (int, optional): The number of batches buffered between two stages. Defaults to
+          the INGEST_QUEUE_SIZE environment variable, or 4.
+        - poll_interval (float, optional): How often blocked stages check for a shutdown, in seconds.
+          Defaults to 0.1.
+        """
+        if queue_size is None:
+            queue_size = int(os.environ.get("INGEST_QUEUE_SIZE", "4"))
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        # stage name -> [items, busy seconds]
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error = None
+        self._threads = []
+
+    def record(self, stage, items, seconds):
+        """
+        Adds to the item count and busy time of a stage.
+
+        Args:
+        - stage (str): The stage name.
+        - items (int): The number of items processed.
+        - seconds (float): The time spent processing them.
+        """
+        with self._lock:
+            counts = self.counts.setdefault(stage, [0, 0.0])
+            counts[0] += items
+            counts[1] += seconds
+        metrics.inc("ingest_items_total", items, stage=stage)
+        metrics.inc("ingest_busy_seconds_total", seconds, stage=stage)
+
+    def items(self, stage):
+        """
+        Returns the number of items a stage has produced so far.
+
+        Args:
+        - stage (str): The stage name.
+
+        Returns:
+        - int: The number of items.
+        """
+        with self._lock:
+            return self.counts.get(stage, [0, 0.0])[0]
+
+    def _put(self, queue, item):
+        """
+        Puts an item on a queue, waiting while it is full.
+        """
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                queue.put(item, timeout=self.poll_interval)
+                return
+            except Full:
+                pass
+
+    def _get(self, queue):
+        """
+        Takes an item from a queue, waiting while it is empty.
+        """
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return queue.get(timeout=self.poll_interval)
+            except Empty:
+                pass
+
+    def _drain(self, queue, waited):
+        """
+        Iterates over the batches on a queue until the previous stage is done, adding the
+        time spent waiting for them to waited[0].
+        """
+        while True:
+            start = time.perf_counter()
+            item = self._get(queue)
+            waited[0] += time.perf_counter() - start
+            if item is _DONE:
+                return
+            yield item
+
+    def _run_stage(self, name, function, inbox, outbox):
+        waited = [0.0]
+        busy = 0.0
+        try:
+            batches = function(None if inbox is None else self._drain(inbox, waited))
+            start = time.perf_counter()
+            for batch in batches:
+                seconds = time.perf_counter() - start - waited[0]
+                self._put(outbox, batch)
+                self.record(name, len(batch), seconds)
+                busy += seconds
+                waited[0] = 0.0
+                start = time.perf_counter()
+            # Count the work after the last batch, e.g. splitting pages that yield no chunk
+            seconds = time.perf_counter() - start - waited[0]
+            self.record(name, 0, seconds)
+            metrics.observe("stage_duration_seconds", busy + seconds, stage=name)
+            self._put(outbox, _DONE)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self._stop.set()
+
+    def run(self, stages):
+        """
+        Starts the stages and yields the batches of the last one.
+
+        Args:
+        - stages (list): (name, function) pairs. The first function is called with None and the
+          others with an iterator over the batches of the previous stage, and each returns an
+          iterable of lists, e.g. a generator.
+
+        Yields:
+        - list: The next batch of the last stage. A failure in any stage is raised here.
+        """
+        inbox = None
+        for name, function in stages:
+            outbox = Queue(maxsize=self.queue_size)
+            thread = threading.Thread(
+                target=self._run_stage,
+                args=(name, function, inbox, outbox),
+                name=f"ingest-{name}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+            inbox = outbox
+        try:
+            while True:
+                try:
+                    item = self._get(inbox)
+                except _Stopped:
+                    break
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def stats(self):
+        """
+        Returns the throughput of every stage.
+
+        Returns:
+        - dict: The items, busy seconds and items per busy second of each stage.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "items": items,
+                    "busy_seconds": round(seconds, 3),
+                    "items_per_second": round(items / seconds, 2) if seconds else None,
+                }
+                for name, (items, seconds) in self.counts.items()
+            }
@@ -0,0 +1,173 @@
+from concurrent.futures import ThreadPoolExecutor
+from src.job_store import JobStore
+import os
+import shutil
+import time
+import uuid
+
+
+class IngestionJobs:
+    """
+    Runs document uploads as background jobs on a bounded worker pool and
+    keeps their stage-level progress for the job status API. The status is kept
+    in a JobStore, so any worker process can report it, also after a restart.
+    """
+
+    def __init__(
+        self,
+        upload_doc,
+        max_workers=None,
+        max_history=None,
+        upload_folder="uploads",
+        store_path=None,
+    ):
+        """
+        Initializes the IngestionJobs. Jobs left unfinished by a worker process that is no
+        longer running are marked as failed.
+
+        Args:
+        - upload_doc (callable): A function taking a document path and a progress callback,
+          like `Utils.upload_doc`.
+        - max_workers (int, optional): The number of documents ingested at the same time. Defaults to the
+          INGEST_MAX_WORKERS environment variable, or 2.
+        - max_history (int, optional): The number of jobs whose status is kept. Defaults to the
+          INGEST_JOB_HISTORY environment variable, or 1000.
+        - upload_folder (str, optional): The folder uploads are staged in. Defaults to "uploads".
+        - store_path (str, optional): The path to the SQLite job store. Defaults to the
+          INGEST_JOBS_PATH environment variable, or "jobs.db" inside upload_folder.
+        """
+        if max_workers is None:
+            max_workers = int(os.environ.get("INGEST_MAX_WORKERS", "2"))
+        if max_history is None:
+            max_history = int(os.environ.get("INGEST_JOB_HISTORY", "1000"))
+        if store_path is None:
+            store_path = os.environ.get(
+                "INGEST_JOBS_PATH", os.path.join(upload_folder, "jobs.db")
+            )
+        self.upload_doc = upload_doc
+        self.max_history = max_history
+        self.upload_folder = upload_folder
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingest"
+        )
+        self.store = JobStore(store_path, max_history)
+        self._fail_interrupted()
+
+    @staticmethod
+    def _is_running(pid):
+        if pid is None or pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _fail_interrupted(self):
+        """
+        Marks the unfinished jobs of worker processes that are no longer running as failed.
+        """
+        for job in self.store.unfinished():
+            if not self._is_running(job.get("pid")):
+                self.fail(job["id"], "Interrupted before it finished")
+
+    def create(self, filename):
+        """
+        Registers a new job and creates the folder its upload is staged in.
+
+        Args:
+        - filename (str): The name of the uploaded file.
+
+        Returns:
+        - tuple: The job ID and the path the upload should be written to.
+        """
+        job_id = uuid.uuid4().hex
+        job_folder = os.path.join(self.upload_folder, job_id)
+        os.makedirs(job_folder, exist_ok=True)
+        now = time.time()
+        job = {
+            "id": job_id,
+            "filename": filename,
+            "status": "receiving",
+            "stage": "upload",
+            "pages_parsed": 0,
+            "chunks_created": 0,
+            "chunks_embedded": 0,
+            "throughput": None,
+            "index_written": False,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            # The worker process running the job, to detect jobs interrupted by a restart
+            "pid": os.getpid(),
+        }
+        self.store.put(job)
+        return job_id, os.path.join(job_folder, os.path.basename(filename))
+
+    def update(self, job_id, **fields):
+        """
+        Updates the status fields of a job.
+
+        Args:
+        - job_id (str): The ID of the job.
+        - **fields: The fields to update.
+        """
+        self.store.update(job_id, fields)
+
+    def submit(self, job_id, path, ingest=None):
+        """
+        Queues a staged upload for ingestion.
+
+        Args:
+        - job_id (str): The ID of the job.
+        - path (str): The path of the staged upload.
+        - ingest (callable, optional): The function ingesting the document, with the same
+          signature as `upload_doc`. Defaults to `upload_doc`.
+        """
+        self.update(job_id, status="queued", stage="queued")
+        self.executor.submit(self._run, job_id, path, ingest or self.upload_doc)
+
+    def _run(self, job_id, path, ingest):
+        def progress(stage, **counts):
+            self.update(job_id, stage=stage, **counts)
+
+        self.update(job_id, status="running")
+        try:
+            result = ingest(path, progress=progress)
+            if result == "Upload Successful!":
+                self.update(job_id, status="completed", stage="done")
+            else:
+                error = (self.store.get(job_id) or {}).get("error")
+                self.update(job_id, status="failed", error=error or result)
+        except Exception as e:
+            self.update(job_id, status="failed", error=str(e))
+        finally:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    def fail(self, job_id, error):
+        """
+        Marks a job as failed and removes its staged upload.
+
+        Args:
+        - job_id (str): The ID of the job.
+        - error (str): The error message.
+        """
+        self.update(job_id, status="failed", error=error)
+        shutil.rmtree(os.path.join(self.upload_folder, job_id), ignore_errors=True)
+
+    def get(self, job_id):
+        """
+        Returns the status of a job.
+
+        Args:
+        - job_id (str): The ID of the job.
+
+        Returns:
+        - dict: A copy of the job status, or None if the job is unknown.
+        """
+        job = self.store.get(job_id)
+        if job is not None:
+            job.pop("pid", None)
+        return job
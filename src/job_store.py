@@ -0,0 +1,128 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class JobStore:
+    """
+    The status of the ingestion jobs in SQLite, shared by the worker processes of the
+    API and kept across restarts. Each job is a JSON document with its stage-level
+    progress; only the most recent jobs are kept.
+    """
+
+    def __init__(self, path, max_history=1000):
+        """
+        Initializes the JobStore.
+
+        Args:
+        - path (str): The path to the SQLite database.
+        - max_history (int, optional): The number of jobs whose status is kept. Defaults to 1000.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_history = max_history
+        self._lock = threading.Lock()
+        # Transactions are begun explicitly, so updates can lock the database up front
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Progress is updated per batch; losing the last updates on a power failure is fine
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, created_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at)"
+        )
+
+    def put(self, job):
+        """
+        Records a new job, dropping the oldest jobs beyond max_history.
+
+        Args:
+        - job (dict): The status of the job, with its id and created_at.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs (id, created_at, data) VALUES (?, ?, ?)",
+                    (job["id"], job["created_at"], json.dumps(job)),
+                )
+                self._conn.execute(
+                    "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs "
+                    "ORDER BY created_at DESC, id DESC LIMIT -1 OFFSET ?)",
+                    (self.max_history,),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def update(self, job_id, fields):
+        """
+        Updates the status fields of a job.
+
+        Args:
+        - job_id (str): The ID of the job.
+        - fields (dict): The fields to update.
+
+        Returns:
+        - dict or None: The updated status, or None if the job is unknown.
+        """
+        with self._lock:
+            # Read and write in one transaction, so updates from other processes are not lost
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT data FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+                job = None
+                if row is not None:
+                    job = json.loads(row[0])
+                    job.update(fields, updated_at=time.time())
+                    self._conn.execute(
+                        "UPDATE jobs SET data = ? WHERE id = ?",
+                        (json.dumps(job), job_id),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job
+
+    def get(self, job_id):
+        """
+        Returns the status of a job.
+
+        Args:
+        - job_id (str): The ID of the job.
+
+        Returns:
+        - dict or None: The status of the job, or None if the job is unknown.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def unfinished(self):
+        """
+        Returns the jobs that have not completed or failed.
+
+        Returns:
+        - list: The status of every unfinished job.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM jobs "
+                "WHERE json_extract(data, '$.status') NOT IN ('completed', 'failed')"
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
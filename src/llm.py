@@ -1,6 +1,8 @@
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
+import threading
 from src.prompts import rephrase_prompt, system_prompt
+from src.metrics import metrics
+import time
 
 
 class LLM:
@@ -8,18 +10,41 @@ class LLM:
     A class to interact with the LangChain model for generating human-like text.
     """
 
-    def __init__(self):
+    def __init__(self, llm=None):
         """
-        Initializes the LLM with a ChatGoogleGenerativeAI instance.
+        Initializes the LLM. The ChatGoogleGenerativeAI client is only imported and built
+        on first use, so creating an LLM is cheap.
+
+        Args:
+        - llm (BaseChatModel, optional): The chat model to use instead, e.g. a local fake for
+          benchmarks. Defaults to gemini-1.5-pro.
         """
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-pro",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-            api_key=os.environ.get("GOOGLE_API_KEY"),
-        )
+        self._llm = llm
+        self._lock = threading.Lock()
+
+    @property
+    def llm(self):
+        """
+        The chat model, built on first access.
+        """
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    from langchain_google_genai import ChatGoogleGenerativeAI
+
+                    self._llm = ChatGoogleGenerativeAI(
+                        model="gemini-1.5-pro",
+                        temperature=0,
+                        max_tokens=None,
+                        timeout=None,
+                        max_retries=2,
+                        api_key=os.environ.get("GOOGLE_API_KEY"),
+                    )
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
 
     def rephrase(self, new_query, conv) -> str:
         """
@@ -41,7 +66,35 @@ class LLM:
                 ),
             ]
 
-            ai_msg = self.llm.invoke(messages)
+            with metrics.timer(stage="llm_rephrase"):
+                ai_msg = self.llm.invoke(messages)
+            return ai_msg.content
+        except Exception as e:
+            print(f"Error rephrasing query: {e}")
+            return "Failed to rephrase query."
+
+    async def arephrase(self, new_query, conv) -> str:
+        """
+        Asynchronously rephrases a given query based on the conversation history.
+
+        Args:
+        - new_query (str): The new query to be rephrased.
+        - conv (list): A list of conversation history.
+
+        Returns:
+        - str: The rephrased query.
+        """
+        try:
+            messages = [
+                ("system", f"{rephrase_prompt.format(conv)}"),
+                (
+                    "human",
+                    f"User: {new_query}\nRephrased Query: ",
+                ),
+            ]
+
+            with metrics.timer(stage="llm_rephrase"):
+                ai_msg = await self.llm.ainvoke(messages)
             return ai_msg.content
         except Exception as e:
             print(f"Error rephrasing query: {e}")
@@ -69,12 +122,128 @@ class LLM:
                     f"{query}",
                 ),
             ]
-            ai_msg = self.llm.invoke(messages)
+            with metrics.timer(stage="llm_qa"):
+                ai_msg = self.llm.invoke(messages)
+            return ai_msg.content
+        except Exception as e:
+            print(f"Error answering question: {e}")
+            return "Failed to answer question."
+
+    async def aqa(self, query, context) -> str:
+        """
+        Asynchronously answers a question based on the given context.
+
+        Args:
+        - query (str): The question to be answered.
+        - context (str): The context in which the question is asked.
+
+        Returns:
+        - str: The answer to the question.
+        """
+        try:
+            messages = [
+                (
+                    "system",
+                    f"{system_prompt.format(context)}",
+                ),
+                (
+                    "human",
+                    f"{query}",
+                ),
+            ]
+            with metrics.timer(stage="llm_qa"):
+                ai_msg = await self.llm.ainvoke(messages)
             return ai_msg.content
         except Exception as e:
             print(f"Error answering question: {e}")
             return "Failed to answer question."
 
+    def qa_stream(self, query, context, raise_errors=False):
+        """
+        Answers a question based on the given context, yielding the answer as it is generated.
+
+        Args:
+        - query (str): The question to be answered.
+        - context (str): The context in which the question is asked.
+        - raise_errors (bool, optional): Whether to raise a failure instead of ending the answer
+          with the failure message. Defaults to False.
+
+        Yields:
+        - str: The next piece of the answer.
+        """
+        try:
+            messages = [
+                (
+                    "system",
+                    f"{system_prompt.format(context)}",
+                ),
+                (
+                    "human",
+                    f"{query}",
+                ),
+            ]
+            start = time.perf_counter()
+            first = True
+            for chunk in self.llm.stream(messages):
+                if first:
+                    metrics.observe(
+                        "llm_time_to_first_token_seconds", time.perf_counter() - start
+                    )
+                    first = False
+                if chunk.content:
+                    yield chunk.content
+            metrics.observe(
+                "stage_duration_seconds", time.perf_counter() - start, stage="llm_qa"
+            )
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Error answering question: {e}")
+            yield "Failed to answer question."
+
+    async def aqa_stream(self, query, context, raise_errors=False):
+        """
+        Asynchronously answers a question based on the given context, yielding the answer as it is generated.
+
+        Args:
+        - query (str): The question to be answered.
+        - context (str): The context in which the question is asked.
+        - raise_errors (bool, optional): Whether to raise a failure instead of ending the answer
+          with the failure message. Defaults to False.
+
+        Yields:
+        - str: The next piece of the answer.
+        """
+        try:
+            messages = [
+                (
+                    "system",
+                    f"{system_prompt.format(context)}",
+                ),
+                (
+                    "human",
+                    f"{query}",
+                ),
+            ]
+            start = time.perf_counter()
+            first = True
+            async for chunk in self.llm.astream(messages):
+                if first:
+                    metrics.observe(
+                        "llm_time_to_first_token_seconds", time.perf_counter() - start
+                    )
+                    first = False
+                if chunk.content:
+                    yield chunk.content
+            metrics.observe(
+                "stage_duration_seconds", time.perf_counter() - start, stage="llm_qa"
+            )
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Error answering question: {e}")
+            yield "Failed to answer question."
+
 
 if __name__ == "__main__":
     try:
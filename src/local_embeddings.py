@@ -0,0 +1,146 @@
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+import itertools
+import os
+import queue
+import threading
+import time
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    An offline embedding engine running a sentence-transformers model on CPU.
+    Requests from concurrent callers are collected by a single worker thread and
+    encoded together in dynamic batches. Queries are encoded before any queued
+    document chunks, so they do not wait for a large ingestion.
+    """
+
+    # Request priorities, lowest first
+    QUERY = 0
+    DOCUMENTS = 1
+
+    def __init__(
+        self, model=None, num_threads=None, max_batch_size=None, max_wait_ms=None
+    ):
+        """
+        Initializes the LocalEmbeddings and starts its batching worker.
+
+        Args:
+        - model (str, optional): The sentence-transformers model name. Defaults to the
+          LOCAL_EMBEDDING_MODEL environment variable, or "sentence-transformers/all-MiniLM-L6-v2".
+        - num_threads (int, optional): The number of CPU threads used by torch. Defaults to the
+          EMBEDDING_THREADS environment variable, or the torch default.
+        - max_batch_size (int, optional): The maximum number of texts encoded together. Defaults to the
+          EMBEDDING_MAX_BATCH environment variable, or 64.
+        - max_wait_ms (float, optional): How long the worker waits for more requests to fill a batch.
+          Defaults to the EMBEDDING_BATCH_WAIT_MS environment variable, or 5.
+        """
+        from sentence_transformers import SentenceTransformer
+        import torch
+
+        if model is None:
+            model = os.environ.get(
+                "LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+            )
+        if num_threads is None and os.environ.get("EMBEDDING_THREADS"):
+            num_threads = int(os.environ["EMBEDDING_THREADS"])
+        if max_batch_size is None:
+            max_batch_size = int(os.environ.get("EMBEDDING_MAX_BATCH", "64"))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.environ.get("EMBEDDING_BATCH_WAIT_MS", "5"))
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._encoder = SentenceTransformer(model, device="cpu")
+        # (priority, sequence number, texts, future); the sequence keeps each priority FIFO
+        self._requests = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._worker = threading.Thread(
+            target=self._run, name="local-embeddings", daemon=True
+        )
+        self._worker.start()
+
+    def _run(self):
+        """
+        Collects pending requests, queries first, into batches of up to max_batch_size texts
+        and encodes them.
+        """
+        while True:
+            batch = [self._requests.get()[2:]]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if size + len(request[2]) > self.max_batch_size:
+                    # Requeued with its sequence number, so it keeps its place
+                    self._requests.put(request)
+                    break
+                batch.append(request[2:])
+                size += len(request[2])
+
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                vectors = self._encoder.encode(
+                    texts,
+                    batch_size=self.max_batch_size,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for request_texts, future in batch:
+                end = start + len(request_texts)
+                future.set_result(vectors[start:end].tolist())
+                start = end
+
+    def _submit(self, texts, priority):
+        future = Future()
+        self._requests.put((priority, next(self._sequence), texts, future))
+        return future
+
+    def embed_documents(self, texts):
+        """
+        Embeds a list of texts. Long lists are split into batch-sized requests, queued
+        behind any queries, so a query waits for at most the batch being encoded.
+
+        Args:
+        - texts (list): The texts to embed.
+
+        Returns:
+        - list: The embedding of each text.
+        """
+        futures = [
+            self._submit(texts[start : start + self.max_batch_size], self.DOCUMENTS)
+            for start in range(0, len(texts), self.max_batch_size)
+        ]
+        return [vector for future in futures for vector in future.result()]
+
+    def embed_query(self, text):
+        """
+        Embeds a single query.
+
+        Args:
+        - text (str): The query to embed.
+
+        Returns:
+        - list: The embedding of the query.
+        """
+        return self._submit([text], self.QUERY).result()[0]
+
+    def warmup(self):
+        """
+        Runs one encoding so the first real request does not pay for lazy initialization.
+        """
+        self.embed_query("warm up")
@@ -0,0 +1,204 @@
+from contextlib import nullcontext
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+_NOOP = nullcontext()
+
+
+class _Timer:
+    """
+    Times a block into a histogram and, when tracing is set up, wraps it in a span.
+    """
+
+    __slots__ = ("metrics", "name", "labels", "start", "span")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.span = None
+
+    def __enter__(self):
+        if self.metrics.tracer is not None:
+            self.span = self.metrics.tracer.start_as_current_span(
+                self.labels.get("stage", self.name), attributes=self.labels
+            )
+            self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if self.span is not None:
+            self.span.__exit__(exc_type, exc, tb)
+        return False
+
+
+class Metrics:
+    """
+    A small in-process registry of counters and histograms, rendered in the Prometheus
+    text format. Stages can also be exported as OpenTelemetry spans over OTLP.
+    When disabled every call returns immediately.
+    """
+
+    def __init__(self, enabled=None, prefix="rag_"):
+        """
+        Initializes the Metrics registry.
+
+        Args:
+        - enabled (bool, optional): Whether to record anything. Defaults to the METRICS_ENABLED
+          environment variable, or True.
+        - prefix (str, optional): The prefix of every metric name. Defaults to "rag_".
+        """
+        if enabled is None:
+            enabled = os.environ.get("METRICS_ENABLED", "1") not in ("0", "false")
+        self.enabled = enabled
+        self.prefix = prefix
+        self.tracer = None
+        # name -> (buckets, {labels: [bucket counts..., +Inf count, sum, count]})
+        self._histograms = {}
+        # name -> {labels: value}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increments a counter.
+
+        Args:
+        - name (str): The counter name.
+        - value (float, optional): The increment. Defaults to 1.
+        - **labels: The label values of the series.
+        """
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Records a value in a histogram.
+
+        Args:
+        - name (str): The histogram name.
+        - value (float): The observed value.
+        - buckets (tuple, optional): The upper bounds of the buckets, used when the histogram
+          is first created. Defaults to LATENCY_BUCKETS, in seconds.
+        - **labels: The label values of the series.
+        """
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            bounds, series = self._histograms.setdefault(name, (buckets, {}))
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * (len(bounds) + 3)
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            else:
+                values[len(bounds)] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def timer(self, name="stage_duration_seconds", **labels):
+        """
+        Returns a context manager timing a block into a histogram.
+
+        Args:
+        - name (str, optional): The histogram name. Defaults to "stage_duration_seconds".
+        - **labels: The label values of the series, e.g. stage="load_index".
+
+        Returns:
+        - ContextManager: The timer, or a shared no-op context when metrics are disabled.
+        """
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self, name, labels)
+
+    def setup_tracing(self, app=None):
+        """
+        Exports spans over OTLP when the OTEL_EXPORTER_OTLP_ENDPOINT environment variable is set,
+        and instruments the FastAPI app if one is given.
+
+        Args:
+        - app (FastAPI, optional): The app to instrument.
+        """
+        if not self.enabled or not os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+            return
+        try:
+            from opentelemetry import trace
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+                OTLPSpanExporter,
+            )
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+            provider = TracerProvider(
+                resource=Resource.create(
+                    {"service.name": os.environ.get("OTEL_SERVICE_NAME", "ai-chatbot")}
+                )
+            )
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            trace.set_tracer_provider(provider)
+            self.tracer = trace.get_tracer(__name__)
+            if app is not None:
+                from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
+                FastAPIInstrumentor.instrument_app(app)
+        except Exception as e:
+            print(f"Error setting up tracing: {e}")
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ""
+        escaped = (
+            name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+            for name, value in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+        - str: The metrics.
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                name = self.prefix + name
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for name, (bounds, series) in sorted(self._histograms.items()):
+                name = self.prefix + name
+                lines.append(f"# TYPE {name} histogram")
+                for labels, values in series.items():
+                    cumulative = 0
+                    for bound, count in zip((*bounds, "+Inf"), values):
+                        cumulative += count
+                        le = self._format_labels(labels, [("le", bound)])
+                        lines.append(f"{name}_bucket{le} {cumulative}")
+                    lines.append(
+                        f"{name}_sum{self._format_labels(labels)} {values[-2]}"
+                    )
+                    lines.append(
+                        f"{name}_count{self._format_labels(labels)} {values[-1]}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+# Shared by Utils, PreprocessDoc, LLM and the caches
+metrics = Metrics()
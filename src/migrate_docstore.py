@@ -0,0 +1,118 @@
+"""
+Converts saved indexes from the pickled LangChain docstore (index.pkl) to the SQLite
+chunk store (docstore.db), which is loaded lazily and without unpickling.
+
+Run from the directory holding faiss_index, e.g.:
+
+    python -m src.migrate_docstore                 # every index
+    python -m src.migrate_docstore name1 name2     # only the given indexes
+    python -m src.migrate_docstore --keep-pickle   # keep index.pkl for older releases
+
+Every version folder of an index is converted, so readers still loading the
+previous version find its chunk store too. Run it while no documents are being
+uploaded, added or deleted.
+"""
+
+import argparse
+import json
+import os
+import pickle
+from src.chunk_store import ChunkStore
+from src.index_catalog import IndexCatalog
+from src.preprocess_doc import VERSION_PATTERN
+
+
+def migrate_folder(folder, keep_pickle=False):
+    """
+    Writes the chunk store of one index folder from its pickled docstore.
+
+    Args:
+    - folder (str): The folder holding index.faiss and index.pkl.
+    - keep_pickle (bool, optional): Whether to keep index.pkl. Defaults to False.
+
+    Returns:
+    - bool: True if the folder had a pickled docstore.
+    """
+    pickle_path = os.path.join(folder, "index.pkl")
+    docstore_path = os.path.join(folder, "docstore.db")
+    if not os.path.exists(pickle_path):
+        return False
+    if not os.path.exists(docstore_path):
+        with open(pickle_path, "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        ChunkStore.write(docstore_path, docstore, index_to_docstore_id)
+    if not keep_pickle:
+        os.remove(pickle_path)
+    return True
+
+
+def migrate_index(name, index_folder="faiss_index", keep_pickle=False, catalog=None):
+    """
+    Converts every version folder of an index, and updates the recorded size of its
+    current version in its manifest and the index catalog.
+
+    Args:
+    - name (str): The name of the index.
+    - index_folder (str, optional): The folder holding the saved indexes. Defaults to "faiss_index".
+    - keep_pickle (bool, optional): Whether to keep index.pkl. Defaults to False.
+    - catalog (IndexCatalog, optional): The index catalog to update.
+
+    Returns:
+    - int: The number of converted folders.
+    """
+    path = os.path.join(index_folder, name)
+    folders = [path] + [
+        entry.path
+        for entry in os.scandir(path)
+        if entry.is_dir() and VERSION_PATTERN.fullmatch(entry.name)
+    ]
+    converted = sum(migrate_folder(folder, keep_pickle) for folder in folders)
+
+    try:
+        with open(os.path.join(path, "CURRENT"), "r") as f:
+            current = os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        current = path
+    manifest_path = os.path.join(current, "manifest.json")
+    if converted and os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        manifest["size_bytes"] = sum(
+            entry.stat().st_size for entry in os.scandir(current) if entry.is_file()
+        )
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+        if catalog is not None:
+            catalog.put(name, manifest)
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("names", nargs="*", help="Defaults to every index")
+    parser.add_argument("--index-folder", default="faiss_index")
+    parser.add_argument("--keep-pickle", action="store_true")
+    args = parser.parse_args()
+
+    names = args.names or sorted(
+        entry.name for entry in os.scandir(args.index_folder) if entry.is_dir()
+    )
+    catalog = IndexCatalog(args.index_folder)
+    failed = 0
+    for name in names:
+        try:
+            converted = migrate_index(
+                name, args.index_folder, args.keep_pickle, catalog
+            )
+            print(f"{name}: converted {converted} folder(s)")
+        except Exception as e:
+            failed += 1
+            print(f"Error converting index {name}: {e}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Top-level functions so they can be sent to worker processes
+# when a PDF is extracted in page-range shards
+BACKENDS = ("pypdf", "pypdfium2", "pdfplumber")
+
+
+def page_count(path, backend="pypdfium2"):
+    """
+    Counts the pages of a PDF.
+
+    Args:
+    - path (str): The path to the PDF document.
+    - backend (str, optional): The extraction backend. Defaults to "pypdfium2".
+
+    Returns:
+    - int: The number of pages.
+    """
+    if backend == "pypdfium2":
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    if backend == "pdfplumber":
+        import pdfplumber
+
+        with pdfplumber.open(path) as pdf:
+            return len(pdf.pages)
+    if backend == "pypdf":
+        from pypdf import PdfReader
+
+        return len(PdfReader(path).pages)
+    raise ValueError(f"Unknown PDF backend: {backend}. Choose one of {BACKENDS}")
+
+
+def extract_pages(path, start, end, backend="pypdfium2"):
+    """
+    Extracts the text of a range of pages of a PDF.
+
+    Args:
+    - path (str): The path to the PDF document.
+    - start (int): The first page to extract (0-based).
+    - end (int): The page after the last page to extract.
+    - backend (str, optional): The extraction backend. Defaults to "pypdfium2".
+
+    Returns:
+    - list: (page number, text) tuples in page order.
+    """
+    pages = []
+    if backend == "pypdfium2":
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            for number in range(start, end):
+                page = pdf[number]
+                text_page = page.get_textpage()
+                pages.append((number, text_page.get_text_range()))
+                text_page.close()
+                page.close()
+        finally:
+            pdf.close()
+    elif backend == "pdfplumber":
+        import pdfplumber
+
+        with pdfplumber.open(path, pages=list(range(start + 1, end + 1))) as pdf:
+            for number, page in zip(range(start, end), pdf.pages):
+                pages.append((number, page.extract_text() or ""))
+    elif backend == "pypdf":
+        from pypdf import PdfReader
+
+        reader = PdfReader(path)
+        for number in range(start, end):
+            pages.append((number, reader.pages[number].extract_text() or ""))
+    else:
+        raise ValueError(f"Unknown PDF backend: {backend}. Choose one of {BACKENDS}")
+    return pages
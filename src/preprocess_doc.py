@@ -1,8 +1,39 @@
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import TokenTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
+# LangChain is imported where it is first needed, which keeps process startup fast
+from src.embedding_cache import EmbeddingCache
+from src.embedding_pipeline import EmbeddingPipeline
+from src import pdf_extract
+from src import ann_index
+from src.bm25 import BM25Index
+from src.chunk_store import ChunkStore
+from src.index_catalog import IndexCatalog
+from src.ingest_pipeline import IngestPipeline
+from src.metrics import metrics
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import faiss
+import json
+import multiprocessing
+import multiprocessing.util
 import os
+import pickle
+import re
+import shutil
+import threading
+import time
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: index writes are only serialized within the process
+    fcntl = None
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+# Reciprocal-rank fusion constant, dampening the weight of the top ranks
+RRF_K = 60
+# The version folders written by save_index, v<nanoseconds since the epoch>
+VERSION_PATTERN = re.compile(r"v\d+")
 
 
 class PreprocessDoc:
@@ -11,110 +42,899 @@ class PreprocessDoc:
     creating and retrieving indexes, and searching for relevant documents.
     """
 
-    def __init__(self):
+    def __init__(self, embedding_function=None, backend=None):
         """
-        Initializes the PreprocessDoc class with a GoogleGenerativeAIEmbeddings instance.
+        Initializes the PreprocessDoc class with an embedding function, an EmbeddingCache,
+        an EmbeddingPipeline and an IndexCatalog. The embedding client is only built on first use.
+
+        Args:
+        - embedding_function (Embeddings, optional): The embedding function to use, e.g. a local
+          fake for testing. Overrides backend.
+        - backend (str, optional): "google" for GoogleGenerativeAIEmbeddings or "local" for an
+          offline sentence-transformers model on CPU. Defaults to the EMBEDDING_BACKEND
+          environment variable, or "google".
         """
-        self.embedding_function = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001"
-        )
+        if embedding_function is not None:
+            backend = "custom"
+        elif backend is None:
+            backend = os.environ.get("EMBEDDING_BACKEND", "google")
+        self.backend = backend
+        # (backend, model) -> embedding function, for indexes built with other models
+        self._embedding_functions = {}
+        self._embedding_function = None
+        self._lock = threading.Lock()
+        # Held while loading the model of an index, so concurrent requests load it only once
+        self._functions_lock = threading.Lock()
+        if embedding_function is not None:
+            self.embedding_function = embedding_function
+        self.embedding_cache = EmbeddingCache()
+        self.embedding_pipeline = EmbeddingPipeline()
+        self.index_catalog = IndexCatalog()
+        # Process pool for PDF extraction, shared by every document and started on first use
+        self._pdf_pool = None
+
+    @property
+    def embedding_function(self):
+        """
+        The embedding function of the configured backend, built on first access.
+        """
+        if self._embedding_function is None:
+            with self._lock:
+                if self._embedding_function is None:
+                    function = self.create_embedding_function(self.backend)
+                    self._embedding_functions[
+                        (self.backend, EmbeddingCache.model_name(function))
+                    ] = function
+                    self._embedding_function = function
+        return self._embedding_function
+
+    @embedding_function.setter
+    def embedding_function(self, embedding_function):
+        self._embedding_functions[
+            (self.backend, EmbeddingCache.model_name(embedding_function))
+        ] = embedding_function
+        self._embedding_function = embedding_function
+
+    @staticmethod
+    def create_embedding_function(backend, model=None):
+        """
+        Creates an embedding function for a backend.
 
-    def pdf_loader(self, doc):
+        Args:
+        - backend (str): "google" or "local".
+        - model (str, optional): The model name. Defaults to the backend's default model.
+
+        Returns:
+        - Embeddings: The embedding function.
         """
-        Loads and splits a PDF document into pages.
+        if backend == "google":
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+            return GoogleGenerativeAIEmbeddings(model=model or "models/embedding-001")
+        if backend == "local":
+            from src.local_embeddings import LocalEmbeddings
+
+            return LocalEmbeddings(model)
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    def warmup(self):
+        """
+        Warms up the embedding function if it supports it, e.g. loads and runs a local model.
+        """
+        if hasattr(self.embedding_function, "warmup"):
+            self.embedding_function.warmup()
+
+    def index_embedding_function(self, filename):
+        """
+        Returns the embedding function for the model an index was built with, as recorded
+        in the index catalog, so queries and additions always use the same model as the index.
+
+        Args:
+        - filename (str): The filename of the index.
+
+        Returns:
+        - Embeddings: The embedding function.
+        """
+        manifest = self.index_catalog.get(filename) or {}
+        model = manifest.get("embedding_model")
+        backend = manifest.get("embedding_backend")
+        if model is None or model == EmbeddingCache.model_name(self.embedding_function):
+            return self.embedding_function
+        key = (backend, model)
+        function = self._embedding_functions.get(key)
+        if function is None:
+            if backend not in ("google", "local"):
+                print(
+                    f"Warning: index {filename} was built with {model}, using "
+                    f"{EmbeddingCache.model_name(self.embedding_function)} instead"
+                )
+                return self.embedding_function
+            with self._functions_lock:
+                function = self._embedding_functions.get(key)
+                if function is None:
+                    function = self.create_embedding_function(backend, model)
+                    self._embedding_functions[key] = function
+        return function
+
+    def pdf_loader(self, doc, backend=None):
+        """
+        Loads a PDF document into pages, collecting the shards extracted by `iter_pages`.
 
         Args:
         - doc (str): The path to the PDF document.
+        - backend (str, optional): The extraction backend, one of "pypdf", "pypdfium2" or "pdfplumber".
+          Defaults to the PDF_BACKEND environment variable, or "pypdfium2".
 
         Returns:
         - list: A list of pages extracted from the PDF.
         """
         try:
-            loader = PyPDFLoader(doc)
-            pages = loader.load_and_split()
+            with metrics.timer(stage="parse_pdf"):
+                pages = [
+                    page for batch in self.iter_pages(doc, backend) for page in batch
+                ]
             print("PDF Uploaded")
             return pages
         except Exception as e:
             print(f"Error loading PDF: {e}")
             return []
 
+    def _pdf_executor(self, max_workers):
+        """
+        Returns the shared PDF extraction pool, starting it on first use. Workers are started
+        from a forkserver (or spawned where it is unavailable) rather than forked from this
+        multi-threaded process, which could copy locks held by other threads. The pool is shut
+        down when the process exits, as a multiprocessing child (e.g. a uvicorn worker) would
+        otherwise wait forever for the idle workers on exit. That runs before the pool's task
+        queue is closed (exit priority 10), so the workers still receive their stop signal.
+        """
+        with self._lock:
+            if self._pdf_pool is None:
+                method = (
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+                self._pdf_pool = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    mp_context=multiprocessing.get_context(method),
+                )
+                multiprocessing.util.Finalize(
+                    self._pdf_pool, self._pdf_pool.shutdown, exitpriority=20
+                )
+            return self._pdf_pool
+
+    def iter_pages(self, doc, backend=None):
+        """
+        Loads a PDF document shard by shard. Shards of PDF_SHARD_PAGES pages are extracted in
+        the shared pool of PDF_MAX_WORKERS worker processes, with at most two shards per worker
+        in flight, and yielded in page order.
+
+        Args:
+        - doc (str): The path to the PDF document.
+        - backend (str, optional): The extraction backend, see `pdf_loader`.
+
+        Yields:
+        - list: The non-empty pages of the next shard.
+        """
+        if backend is None:
+            backend = os.environ.get("PDF_BACKEND", "pypdfium2")
+        shard_pages = int(os.environ.get("PDF_SHARD_PAGES", "32"))
+        max_workers = int(os.environ.get("PDF_MAX_WORKERS", str(os.cpu_count())))
+        from langchain_core.documents import Document
+
+        def documents(shard):
+            pages = [
+                Document(page_content=text, metadata={"source": doc, "page": number})
+                for number, text in shard
+                if text.strip()
+            ]
+            metrics.inc("pages_parsed_total", len(pages))
+            return pages
+
+        # PDFium is not thread-safe, so even small documents are read in the worker processes
+        executor = self._pdf_executor(max_workers)
+        pending = deque()
+        try:
+            total = executor.submit(pdf_extract.page_count, doc, backend).result()
+            shards = [
+                (start, min(start + shard_pages, total))
+                for start in range(0, total, shard_pages)
+            ]
+            workers = min(max_workers, len(shards))
+            for s, e in shards:
+                pending.append(
+                    executor.submit(pdf_extract.extract_pages, doc, s, e, backend)
+                )
+                if len(pending) >= 2 * workers:
+                    yield documents(pending.popleft().result())
+            while pending:
+                yield documents(pending.popleft().result())
+        except BrokenProcessPool:
+            # A worker died, e.g. killed for memory; start a new pool for the next document
+            with self._lock:
+                if self._pdf_pool is executor:
+                    self._pdf_pool = None
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _text_splitter(self):
+        from langchain_text_splitters import TokenTextSplitter
+
+        return TokenTextSplitter(chunk_size=512, chunk_overlap=128)
+
     def create_chunks(self, text):
         """
         Splits a given text into chunks based on a specified size and overlap.
 
         Args:
-        - text (str): The text to be split into chunks.
+        - text (list): The pages to be split into chunks.
 
         Returns:
         - list: A list of chunks created from the input text.
         """
         try:
-            text_splitter = TokenTextSplitter(chunk_size=512, chunk_overlap=128)
-            chunks = text_splitter.split_documents(text)
+            with metrics.timer(stage="chunk"):
+                chunks = [
+                    chunk for batch in self.iter_chunks([text]) for chunk in batch
+                ]
             print("Chunks Created")
             return chunks
         except Exception as e:
             print(f"Error creating chunks: {e}")
             return []
 
-    def create_index(self, chunks, filename="default"):
+    def embed_chunks(self, chunks, embedding_function=None):
+        """
+        Embeds a list of chunks with `iter_embeddings`, reusing embeddings from the embedding
+        cache where possible and sending the misses in concurrent, rate-limit-aware batches.
+
+        Args:
+        - chunks (list): A list of chunks to be embedded.
+        - embedding_function (Embeddings, optional): The embedding function to use, e.g. the one of
+          an existing index. Defaults to the current embedding function.
+
+        Returns:
+        - list: The embedding of each chunk.
+        """
+        try:
+            with metrics.timer(stage="embed_chunks"):
+                vectors = [
+                    vector
+                    for batch in self.iter_embeddings([chunks], embedding_function)
+                    for _, vector in batch
+                ]
+            print("Chunks Embedded")
+            return vectors
+        except Exception as e:
+            print(f"Error embedding chunks: {e}")
+            return []
+
+    def iter_chunks(self, pages, doc_id=None):
+        """
+        Splits batches of pages into chunks as they arrive.
+
+        Args:
+        - pages (iterable): Lists of pages, e.g. from `iter_pages`.
+        - doc_id (str, optional): The document ID recorded in the metadata of every chunk.
+
+        Yields:
+        - list: The chunks of the next non-empty list of pages.
+        """
+        text_splitter = self._text_splitter()
+        for batch in pages:
+            chunks = text_splitter.split_documents(batch)
+            if doc_id is not None:
+                for chunk in chunks:
+                    chunk.metadata["doc_id"] = doc_id
+            metrics.inc("chunks_created_total", len(chunks))
+            if chunks:
+                yield chunks
+
+    def iter_embeddings(self, chunk_batches, embedding_function=None):
+        """
+        Embeds batches of chunks as they arrive. Chunks are regrouped into batches of the
+        embedding pipeline's batch size, up to its max_workers batches are embedded at a time,
+        and the embedding cache is used as in `embed_chunks`.
+
+        Args:
+        - chunk_batches (iterable): Lists of chunks, e.g. from `iter_chunks`.
+        - embedding_function (Embeddings, optional): The embedding function to use. Defaults to
+          the current embedding function.
+
+        Yields:
+        - list: The next batch of (chunk, embedding) pairs, in input order.
+        """
+        if embedding_function is None:
+            embedding_function = self.embedding_function
+        batch_size = self.embedding_pipeline.batch_size
+        max_in_flight = self.embedding_pipeline.max_workers
+
+        def embed(chunks):
+            vectors = self.embedding_cache.embed_documents(
+                [chunk.page_content for chunk in chunks],
+                embedding_function,
+                embed=lambda batch: self.embedding_pipeline.embed(
+                    batch, embedding_function.embed_documents
+                ),
+            )
+            if len(vectors) != len(chunks):
+                raise ValueError("The document chunks could not be embedded")
+            return list(zip(chunks, vectors))
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            pending = deque()
+            buffer = []
+            try:
+                for chunks in chunk_batches:
+                    buffer.extend(chunks)
+                    while len(buffer) >= batch_size:
+                        pending.append(executor.submit(embed, buffer[:batch_size]))
+                        buffer = buffer[batch_size:]
+                        if len(pending) >= max_in_flight:
+                            yield pending.popleft().result()
+                if buffer:
+                    pending.append(executor.submit(embed, buffer))
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def stream_document(self, doc, doc_id=None, embedding_function=None, progress=None):
+        """
+        Parses, chunks and embeds a PDF document in a pipeline: each stage runs in its own
+        thread with a bounded queue to the next, so the stages overlap and only a few batches
+        are held in memory at a time. The stages are named after their stage_duration_seconds
+        histograms, "parse_pdf", "chunk" and "embed_chunks", and the time the caller spends on
+        each batch is counted as the "index" stage.
+
+        Args:
+        - doc (str): The path to the PDF document.
+        - doc_id (str, optional): The document ID recorded in the metadata of every chunk.
+        - embedding_function (Embeddings, optional): The embedding function to use. Defaults to
+          the current embedding function.
+        - progress (callable, optional): Called with a stage name and counters: "embedding" with
+          pages_parsed, chunks_created and chunks_embedded after every batch, and "indexing" with
+          the throughput of every stage at the end.
+
+        Yields:
+        - list: The next batch of (chunk, embedding) pairs, in document order.
+        """
+        if progress is None:
+            progress = lambda stage, **counts: None
+        pipeline = IngestPipeline()
+        batches = pipeline.run(
+            [
+                ("parse_pdf", lambda _: self.iter_pages(doc)),
+                ("chunk", lambda pages: self.iter_chunks(pages, doc_id)),
+                (
+                    "embed_chunks",
+                    lambda chunks: self.iter_embeddings(chunks, embedding_function),
+                ),
+            ]
+        )
+        start = time.perf_counter()
+        for batch in batches:
+            progress(
+                "embedding",
+                pages_parsed=pipeline.items("parse_pdf"),
+                chunks_created=pipeline.items("chunk"),
+                chunks_embedded=pipeline.items("embed_chunks"),
+            )
+            begin = time.perf_counter()
+            yield batch
+            pipeline.record("index", len(batch), time.perf_counter() - begin)
+        throughput = pipeline.stats()
+        print(
+            f"Ingested {doc} in {time.perf_counter() - start:.2f}s: "
+            + ", ".join(
+                f"{stage} {counts['items_per_second']}/s"
+                for stage, counts in throughput.items()
+            )
+        )
+        progress("indexing", throughput=throughput)
+
+    def index_path(self, filename):
+        """
+        Resolves the folder holding the current version of an index.
+
+        Indexes are written to versioned subfolders of faiss_index/<filename> and the
+        CURRENT file names the live version, so a rewrite can be published atomically.
+        Indexes saved directly in faiss_index/<filename> are still supported.
+
+        Args:
+        - filename (str): The filename of the index.
+
+        Returns:
+        - str: The path of the folder holding the index files.
+        """
+        path = os.path.join("faiss_index", filename)
+        try:
+            with open(os.path.join(path, "CURRENT"), "r") as f:
+                return os.path.join(path, f.read().strip())
+        except FileNotFoundError:
+            return path
+
+    @contextmanager
+    def write_lock(self, filename):
+        """
+        Holds the cross-process write lock of an index, faiss_index/<filename>/write.lock, so
+        the writers in other worker processes load, modify, save and clean up one at a time.
+        It is not reentrant, so callers serialize their own threads before taking it.
+
+        Args:
+        - filename (str): The filename of the index.
+        """
+        path = os.path.join("faiss_index", filename)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "write.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save_index(self, index, filename="default"):
+        """
+        Saves a FAISS index atomically: the files are written to a new version folder
+        which is then published by replacing the CURRENT pointer file. Readers see either
+        the previous or the new version, never a half-written one. Writers must hold
+        `write_lock` for the index.
+
+        Args:
+        - index (FAISS): The FAISS index to be saved.
+        - filename (str, optional): The filename for the index. Defaults to "default".
+        """
+        start = time.perf_counter()
+        path = os.path.join("faiss_index", filename)
+        os.makedirs(path, exist_ok=True)
+        previous = self.index_path(filename)
+        version = f"v{time.time_ns()}"
+        os.makedirs(os.path.join(path, version))
+        faiss.write_index(index.index, os.path.join(path, version, "index.faiss"))
+        ChunkStore.write(
+            os.path.join(path, version, "docstore.db"),
+            index.docstore,
+            index.index_to_docstore_id,
+        )
+        manifest = dict(
+            getattr(index, "index_config", None) or ann_index.default_config("flat")
+        )
+        # Record the embedding model so queries use the model the index was built with
+        manifest["embedding_model"] = EmbeddingCache.model_name(
+            index.embedding_function
+        )
+        manifest["embedding_backend"] = next(
+            (
+                backend
+                for (backend, _), function in list(self._embedding_functions.items())
+                if function is index.embedding_function
+            ),
+            "custom",
+        )
+        self.lexical_index(index).save(os.path.join(path, version, "bm25.json"))
+        # Catalog metadata, so listing and loading indexes need not open their files
+        manifest["version"] = version
+        manifest["chunks"] = len(index.index_to_docstore_id)
+        manifest["dimension"] = index.index.d
+        manifest["size_bytes"] = sum(
+            entry.stat().st_size
+            for entry in os.scandir(os.path.join(path, version))
+            if entry.is_file()
+        )
+        manifest["built_at"] = time.time()
+        with open(os.path.join(path, version, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+
+        pointer = os.path.join(path, f"CURRENT.{version}.tmp")
+        with open(pointer, "w") as f:
+            f.write(version)
+        os.replace(pointer, os.path.join(path, "CURRENT"))
+        self.index_catalog.put(filename, manifest)
+
+        # Keep the previous version for readers still loading it, drop the ones older than
+        # it. Only version folders older than the one just published are removed; files of
+        # an index saved before versioning are left in place, as CURRENT takes precedence.
+        for entry in os.scandir(path):
+            if (
+                entry.is_dir()
+                and VERSION_PATTERN.fullmatch(entry.name)
+                and int(entry.name[1:]) < int(version[1:])
+                and entry.name != os.path.basename(previous)
+            ):
+                shutil.rmtree(entry.path, ignore_errors=True)
+        metrics.observe(
+            "stage_duration_seconds", time.perf_counter() - start, stage="save_index"
+        )
+
+    def create_index(
+        self, chunks, filename="default", vectors=None, index_type=None, config=None
+    ):
         """
         Creates a FAISS index from a list of chunks and saves it locally.
 
         Args:
         - chunks (list): A list of chunks to be indexed.
         - filename (str, optional): The filename for the index. Defaults to "default".
+        - vectors (list, optional): The precomputed embedding of each chunk. Computed with
+          `embed_chunks` if omitted.
+        - index_type (str, optional): "flat" for exact search, or "hnsw" / "ivf" for approximate
+          nearest-neighbour search on large corpora. Defaults to the FAISS_INDEX_TYPE environment
+          variable, or "flat".
+        - config (dict, optional): The full index configuration, overriding index_type. See
+          `ann_index.default_config`.
 
         Returns:
         - FAISS: The created FAISS index.
         """
         try:
-            index = FAISS.from_documents(chunks, self.embedding_function)
-            index.save_local(f"faiss_index/{filename}")
+            if vectors is None:
+                vectors = self.embed_chunks(chunks)
+            if len(vectors) != len(chunks):
+                raise ValueError("Every chunk needs an embedding")
+            if config is None:
+                config = ann_index.default_config(index_type)
+            index = self._new_index(np.asarray(vectors, dtype=np.float32), config)
+            self.add_documents(index, chunks, vectors)
+            self.save_index(index, filename)
             print("Index Created")
             return index
         except Exception as e:
             print(f"Error creating index: {e}")
             return None
 
-    def get_index(self, filename):
+    def _new_index(self, vectors, config, embedding_function=None):
+        """
+        Creates an empty FAISS index of the configured type, with an empty BM25 index.
+
+        Args:
+        - vectors (numpy.ndarray): Vectors representative of the index, used for the dimension
+          and to train IVF indexes.
+        - config (dict): The index configuration, as returned by `ann_index.default_config`.
+        - embedding_function (Embeddings, optional): The embedding function of the index. Defaults
+          to the current embedding function.
+
+        Returns:
+        - FAISS: The empty index.
+        """
+        from langchain_community.vectorstores import FAISS
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+
+        index = FAISS(
+            embedding_function or self.embedding_function,
+            ann_index.build_index(vectors, config),
+            InMemoryDocstore(),
+            {},
+        )
+        index.index_config = config
+        index.bm25 = BM25Index()
+        return index
+
+    def ingest(
+        self,
+        doc,
+        doc_id=None,
+        index_type=None,
+        config=None,
+        embedding_function=None,
+        progress=None,
+    ):
+        """
+        Builds an index from a PDF document with `stream_document`, adding every batch of
+        embedded chunks to the index while the next ones are parsed and embedded. Memory use
+        stays flat in the document size apart from the index itself. The index is not saved.
+
+        Args:
+        - doc (str): The path to the PDF document.
+        - doc_id (str, optional): The document ID recorded in the metadata of every chunk.
+        - index_type (str, optional): The index type, see `create_index`.
+        - config (dict, optional): The full index configuration, overriding index_type.
+        - embedding_function (Embeddings, optional): The embedding function to use. Defaults to
+          the current embedding function.
+        - progress (callable, optional): The progress callback, see `stream_document`.
+
+        Returns:
+        - FAISS: The index, or None if no text could be extracted from the document.
+        """
+        if config is None:
+            config = ann_index.default_config(index_type)
+        index = None
+        # IVF centroids are trained on every vector, so those batches wait for the last one
+        buffered = []
+        for batch in self.stream_document(doc, doc_id, embedding_function, progress):
+            if config["index_type"] == "ivf":
+                buffered.extend(batch)
+                continue
+            chunks = [chunk for chunk, _ in batch]
+            vectors = [vector for _, vector in batch]
+            if index is None:
+                index = self._new_index(
+                    np.asarray(vectors, dtype=np.float32), config, embedding_function
+                )
+            self.add_documents(index, chunks, vectors)
+        if buffered:
+            chunks = [chunk for chunk, _ in buffered]
+            vectors = [vector for _, vector in buffered]
+            index = self._new_index(
+                np.asarray(vectors, dtype=np.float32), config, embedding_function
+            )
+            self.add_documents(index, chunks, vectors)
+        return index
+
+    def add_documents(self, index, chunks, vectors=None):
+        """
+        Adds chunks to an existing FAISS index in memory. Only the new chunks are embedded.
+
+        Args:
+        - index (FAISS): The FAISS index to add the chunks to.
+        - chunks (list): A list of chunks to be added.
+        - vectors (list, optional): The precomputed embedding of each chunk. Computed with
+          `embed_chunks` if omitted.
+
+        Returns:
+        - list: The docstore IDs of the added chunks.
+        """
+        if vectors is None:
+            vectors = self.embed_chunks(chunks)
+        if len(vectors) != len(chunks):
+            raise ValueError("Every chunk needs an embedding")
+        texts = [chunk.page_content for chunk in chunks]
+        ids = index.add_embeddings(
+            list(zip(texts, vectors)), metadatas=[chunk.metadata for chunk in chunks]
+        )
+        self.lexical_index(index).add(ids, texts)
+        return ids
+
+    def lexical_index(self, index):
+        """
+        Returns the BM25 index over the chunks of a FAISS index. It is loaded on first use,
+        so workers serving only dense queries never hold it, and built from the docstore
+        for indexes saved without one.
+
+        Args:
+        - index (FAISS): The FAISS index.
+
+        Returns:
+        - BM25Index: The BM25 index.
+        """
+        if getattr(index, "bm25", None) is None and getattr(index, "bm25_path", None):
+            try:
+                with metrics.timer(stage="load_lexical_index"):
+                    index.bm25 = BM25Index.load(index.bm25_path)
+            except FileNotFoundError:
+                # The version was removed by later rewrites, so rebuild it below
+                index.bm25_path = None
+        if getattr(index, "bm25", None) is None:
+            ids = list(index.index_to_docstore_id.values())
+            index.bm25 = BM25Index()
+            index.bm25.add(
+                ids,
+                [
+                    index.docstore.search(docstore_id).page_content
+                    for docstore_id in ids
+                ],
+            )
+        return index.bm25
+
+    def delete_document(self, index, doc_id):
+        """
+        Deletes every chunk of a source document from a FAISS index in memory.
+
+        Args:
+        - index (FAISS): The FAISS index to delete the chunks from.
+        - doc_id (str): The ID of the source document, as stored in the chunk metadata.
+
+        Returns:
+        - int: The number of deleted chunks.
+        """
+        ids = [
+            docstore_id
+            for docstore_id in index.index_to_docstore_id.values()
+            if index.docstore.search(docstore_id).metadata.get("doc_id") == doc_id
+        ]
+        if not ids:
+            return 0
+        self.lexical_index(index).remove(
+            ids,
+            [index.docstore.search(docstore_id).page_content for docstore_id in ids],
+        )
+        if ann_index.supports_remove(index.index):
+            index.delete(ids)
+        else:
+            # Graph indexes cannot remove vectors, so rebuild from the remaining ones
+            deleted = set(ids)
+            positions = {
+                i
+                for i, docstore_id in index.index_to_docstore_id.items()
+                if docstore_id in deleted
+            }
+            config = getattr(index, "index_config", None) or ann_index.default_config()
+            index.index = ann_index.rebuild_without(index.index, positions, config)
+            index.docstore.delete(ids)
+            remaining = [
+                docstore_id
+                for i, docstore_id in sorted(index.index_to_docstore_id.items())
+                if i not in positions
+            ]
+            index.index_to_docstore_id = dict(enumerate(remaining))
+        return len(ids)
+
+    def get_index(self, filename, mmap=None, writable=False):
         """
         Loads a locally saved FAISS index by its filename.
 
         Args:
         - filename (str): The filename of the index to be loaded.
+        - mmap (bool, optional): Whether to memory-map the vectors read-only, so the worker
+          processes on a host share them. Only for indexes that are searched, never modified.
+          Defaults to the INDEX_MMAP environment variable, or False.
+        - writable (bool, optional): Whether the index is going to be modified. Its chunks are then
+          read into memory and its vectors never mapped. Otherwise chunks are fetched lazily.
 
         Returns:
         - FAISS: The loaded FAISS index.
         """
         try:
-            if os.path.exists(f"faiss_index/{filename}"):
-                index = FAISS.load_local(
-                    f"faiss_index/{filename}",
-                    self.embedding_function,
-                    allow_dangerous_deserialization=True,
-                )
+            if writable:
+                mmap = False
+            elif mmap is None:
+                mmap = os.environ.get("INDEX_MMAP", "0") == "1"
+            path = self.index_path(filename)
+            if filename and os.path.exists(os.path.join(path, "index.faiss")):
+                from langchain_community.vectorstores import FAISS
+
+                with metrics.timer(stage="load_index"):
+                    manifest = self.index_catalog.get(filename)
+                    manifest_path = os.path.join(path, "manifest.json")
+                    if manifest is None or manifest.get("version") != os.path.basename(
+                        path
+                    ):
+                        # Not yet in the catalog, or rewritten since it was last read
+                        manifest = None
+                        if os.path.exists(manifest_path):
+                            with open(manifest_path, "r") as f:
+                                manifest = json.load(f)
+                    vector_index = ann_index.read_index(
+                        os.path.join(path, "index.faiss"),
+                        (manifest or {}).get("index_type", "flat"),
+                        mmap,
+                    )
+                    docstore_path = os.path.join(path, "docstore.db")
+                    if os.path.exists(docstore_path):
+                        store = ChunkStore(docstore_path)
+                        if writable:
+                            docstore, index_to_docstore_id = store.load()
+                        else:
+                            docstore = store
+                            index_to_docstore_id = store.index_to_docstore_id()
+                    else:
+                        print(
+                            f"Warning: index {filename} has a pickled docstore, "
+                            "convert it with python -m src.migrate_docstore"
+                        )
+                        with open(os.path.join(path, "index.pkl"), "rb") as f:
+                            docstore, index_to_docstore_id = pickle.load(f)
+                    index = FAISS(
+                        self.index_embedding_function(filename),
+                        vector_index,
+                        docstore,
+                        index_to_docstore_id,
+                    )
+                    # Restore the index type and its search parameters (efSearch, nprobe)
+                    index.index_config = manifest or ann_index.default_config("flat")
+                    ann_index.apply_search_params(index.index, index.index_config)
+                    bm25_path = os.path.join(path, "bm25.json")
+                    if os.path.exists(bm25_path):
+                        index.bm25_path = bm25_path
                 return index
             else:
+                if (
+                    filename
+                    and not os.path.isdir(os.path.join("faiss_index", filename))
+                    and self.index_catalog.get(filename) is not None
+                ):
+                    # The index was dropped, so it is no longer listed
+                    self.index_catalog.remove(filename)
                 raise FileNotFoundError(f"Index file not found: faiss_index/{filename}")
         except Exception as e:
             print(f"Error loading index: {e}")
             return None
 
-    def get_relevant_documents(self, query, index):
+    def get_relevant_documents(self, query, index, mode=None, k=3, vector=None):
         """
-        Performs a similarity search on the index to find relevant documents.
+        Searches the index for the documents relevant to a query.
 
         Args:
         - query (str): The query to search for.
         - index (FAISS): The FAISS index to search in.
+        - mode (str, optional): "dense" for embedding similarity, "lexical" for BM25 keyword
+          matching without any embedding call, or "hybrid" to fuse both rankings with
+          reciprocal-rank fusion. Defaults to the RETRIEVAL_MODE environment variable, or "dense".
+        - k (int, optional): The number of documents to return. Defaults to 3.
+        - vector (list, optional): The query embedding, if already computed.
 
         Returns:
         - list: A list of relevant documents based on the query.
         """
         try:
-            docs = index.similarity_search(query, k=3)
-            return docs
+            if mode is None:
+                mode = os.environ.get("RETRIEVAL_MODE", "dense")
+            if mode not in RETRIEVAL_MODES:
+                raise ValueError(
+                    f"Unknown retrieval mode: {mode}. Choose one of {RETRIEVAL_MODES}"
+                )
+            if mode == "lexical":
+                with metrics.timer(stage="lexical_search"):
+                    return [
+                        index.docstore.search(docstore_id)
+                        for docstore_id, _ in self.lexical_index(index).search(query, k)
+                    ]
+
+            # Hybrid fuses deeper candidate lists so either ranking can promote a document
+            depth = k if mode == "dense" else 4 * k
+            if vector is None:
+                with metrics.timer(stage="embed_query"):
+                    vector = index.embedding_function.embed_query(query)
+            with metrics.timer(stage="vector_search"):
+                dense = [
+                    docstore_id
+                    for docstore_id, _ in self._search_ids_by_vector(
+                        vector, index, depth
+                    )
+                ]
+            if mode == "dense":
+                return [index.docstore.search(docstore_id) for docstore_id in dense]
+            with metrics.timer(stage="lexical_search"):
+                lexical = [
+                    docstore_id
+                    for docstore_id, _ in self.lexical_index(index).search(query, depth)
+                ]
+            scores = {}
+            for ranking in (dense, lexical):
+                for rank, docstore_id in enumerate(ranking):
+                    scores[docstore_id] = scores.get(docstore_id, 0) + 1 / (
+                        RRF_K + rank + 1
+                    )
+            fused = sorted(scores, key=scores.get, reverse=True)[:k]
+            return [index.docstore.search(docstore_id) for docstore_id in fused]
+        except Exception as e:
+            print(f"Error searching for documents: {e}")
+            return []
+
+    def _search_ids_by_vector(self, vector, index, k):
+        """
+        Returns (docstore id, L2 distance) tuples of the nearest chunks to a query embedding.
+        """
+        query = np.array([vector], dtype=np.float32)
+        if getattr(index, "_normalize_L2", False):
+            faiss.normalize_L2(query)
+        distances, positions = index.index.search(query, k)
+        return [
+            (index.index_to_docstore_id[position], float(distance))
+            for position, distance in zip(positions[0], distances[0])
+            if position != -1
+        ]
+
+    def get_relevant_documents_by_vector(self, vector, index, k=3):
+        """
+        Performs a similarity search on the index with an already embedded query.
+
+        Args:
+        - vector (list): The query embedding.
+        - index (FAISS): The FAISS index to search in.
+        - k (int, optional): The number of documents to return. Defaults to 3.
+
+        Returns:
+        - list: (document, L2 distance) tuples, closest first.
+        """
+        try:
+            with metrics.timer(stage="vector_search"):
+                return index.similarity_search_with_score_by_vector(vector, k=k)
         except Exception as e:
             print(f"Error searching for documents: {e}")
             return []
@@ -0,0 +1,198 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+from src.metrics import metrics
+
+GREETINGS = {
+    "hi",
+    "hii",
+    "hello",
+    "hey",
+    "hey there",
+    "hi there",
+    "hello there",
+    "good morning",
+    "good afternoon",
+    "good evening",
+    "thanks",
+    "thank you",
+    "thanks a lot",
+    "thank you very much",
+    "ok",
+    "okay",
+    "ok thanks",
+    "okay thanks",
+    "great",
+    "cool",
+    "bye",
+    "goodbye",
+}
+# Words that point back at the conversation, so the query cannot stand alone
+REFERENCE_WORDS = {
+    "it",
+    "its",
+    "it's",
+    "they",
+    "them",
+    "their",
+    "theirs",
+    "this",
+    "that",
+    "these",
+    "those",
+    "he",
+    "him",
+    "his",
+    "she",
+    "her",
+    "hers",
+    "there",
+    "former",
+    "latter",
+    "above",
+    "previous",
+    "same",
+    "more",
+    "else",
+    "again",
+    "one",
+    "ones",
+}
+CONTINUATION_STARTS = ("and ", "but ", "so ", "also ", "then ", "or ")
+CONTINUATION_PHRASES = ("what about", "how about", "tell me more", "why not")
+FAILED_REPHRASE = "Failed to rephrase query."
+
+
+class RephraseRouter:
+    """
+    Decides whether a query needs the LLM rephrase call. Queries without history,
+    greetings and queries that already stand on their own are passed through
+    unchanged, and LLM rephrases are cached per (history, query).
+    """
+
+    def __init__(self, empty_conv, min_words=None, max_entries=None):
+        """
+        Initializes the RephraseRouter.
+
+        Args:
+        - empty_conv (list): The conversation returned for a session without history.
+        - min_words (int, optional): The minimum number of words of a query judged standalone. Defaults to
+          the REPHRASE_STANDALONE_MIN_WORDS environment variable, or 5. 0 disables the standalone heuristic.
+        - max_entries (int, optional): The maximum number of cached rephrases. Defaults to the
+          REPHRASE_CACHE_MAX_ENTRIES environment variable, or 1000.
+        """
+        if min_words is None:
+            min_words = int(os.environ.get("REPHRASE_STANDALONE_MIN_WORDS", "5"))
+        if max_entries is None:
+            max_entries = int(os.environ.get("REPHRASE_CACHE_MAX_ENTRIES", "1000"))
+        self.empty_conv = empty_conv
+        self.min_words = min_words
+        self.max_entries = max_entries
+        # hash of (history, query) -> rephrased query
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {
+            "no_history": 0,
+            "greeting": 0,
+            "standalone": 0,
+            "cache_hits": 0,
+            "llm": 0,
+        }
+
+    @staticmethod
+    def _normalize(query):
+        return " ".join(re.findall(r"[a-z0-9']+", query.lower()))
+
+    @staticmethod
+    def _key(query, conv):
+        data = json.dumps([conv, " ".join(query.split())], sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def is_standalone(self, query):
+        """
+        Judges whether a query can be understood without the conversation: it is long
+        enough, does not start like a follow-up and does not refer back to earlier turns.
+
+        Args:
+        - query (str): The query.
+
+        Returns:
+        - bool: True if the query needs no rephrasing.
+        """
+        normalized = self._normalize(query)
+        words = normalized.split()
+        if not self.min_words or len(words) < self.min_words:
+            return False
+        if normalized.startswith(CONTINUATION_STARTS):
+            return False
+        if any(phrase in normalized for phrase in CONTINUATION_PHRASES):
+            return False
+        return not REFERENCE_WORDS.intersection(words)
+
+    def _count(self, path):
+        with self._lock:
+            self.counts[path] += 1
+        metrics.inc("rephrase_total", path=path)
+
+    def route(self, query, conv):
+        """
+        Returns the rephrased query when it can be answered without the LLM.
+
+        Args:
+        - query (str): The query.
+        - conv (list): The conversation history.
+
+        Returns:
+        - str or None: The rephrased query, or None if the LLM has to rephrase it.
+        """
+        if not conv or conv == self.empty_conv:
+            self._count("no_history")
+            return query
+        if self._normalize(query) in GREETINGS:
+            self._count("greeting")
+            return query
+        if self.is_standalone(query):
+            self._count("standalone")
+            return query
+        key = self._key(query, conv)
+        with self._lock:
+            rephrased = self._entries.get(key)
+            if rephrased is not None:
+                self._entries.move_to_end(key)
+        if rephrased is not None:
+            self._count("cache_hits")
+            return rephrased
+        self._count("llm")
+        return None
+
+    def store(self, query, conv, rephrased):
+        """
+        Caches the LLM rephrase of a query. Failed rephrases are not cached.
+
+        Args:
+        - query (str): The query.
+        - conv (list): The conversation history.
+        - rephrased (str): The rephrased query.
+        """
+        if rephrased == FAILED_REPHRASE:
+            return
+        key = self._key(query, conv)
+        with self._lock:
+            self._entries[key] = rephrased
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns how often each path was taken.
+
+        Returns:
+        - dict: The counts of queries passed through for having no history, being a greeting or being
+          standalone, of cache hits and of LLM calls, with the number of cached rephrases.
+        """
+        with self._lock:
+            return {**self.counts, "entries": len(self._entries)}
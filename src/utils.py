@@ -1,65 +1,561 @@
 from src.llm import LLM
 from src.preprocess_doc import PreprocessDoc
+from src.index_cache import IndexCache
+from src.index_catalog import IndexCatalog
+from src.conv_store import ConvStore
+from src.answer_cache import AnswerCache
+from src.rephrase_router import RephraseRouter
+from src.context_builder import ContextBuilder
+from src.prompts import system_prompt
+from src.metrics import metrics, TOKEN_BUCKETS
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import contextvars
+import functools
+import threading
 import os
-import json
+import re
+import time
+
+# Index names become folder names under faiss_index, so they must stay a single path component
+INDEX_NAME_PATTERN = re.compile(r"[\w.-]{1,128}")
 
 
 class Utils:
-    def __init__(self):
+    # The history of a conversation that has not started yet
+    DEFAULT_CONV = [
+        {"role": "user", "content": "Hi"},
+        {"role": "assistant", "content": "Hello, How can I help you?"},
+    ]
+
+    def __init__(self, chat_model=None, embedding_function=None):
+        """
+        Initializes the Utils class with instances of LLM, PreprocessDoc, IndexCache, ConvStore,
+        AnswerCache, RephraseRouter and ContextBuilder.
+
+        Args:
+        - chat_model (BaseChatModel, optional): The chat model passed to LLM, e.g. a local fake for
+          benchmarks. Defaults to Gemini.
+        - embedding_function (Embeddings, optional): The embedding function passed to PreprocessDoc.
+          Defaults to the configured embedding backend.
+        """
+        self.llm = LLM(chat_model)
+        self.preprocess_doc = PreprocessDoc(embedding_function)
+        self.index_cache = IndexCache(
+            resolve_path=self.preprocess_doc.index_path,
+            size_of=self.preprocess_doc.index_catalog.size_of,
+            version_of=self.preprocess_doc.index_catalog.version_of,
+        )
+        self._write_locks = {}
+        self._write_locks_lock = threading.Lock()
+        self.conv_store = ConvStore()
+        self.answer_cache = AnswerCache(
+            lambda query: self.preprocess_doc.embedding_function.embed_query(query),
+            version_of=self.preprocess_doc.index_catalog.version_of,
+        )
+        self.rephrase_router = RephraseRouter(self.DEFAULT_CONV)
+        self.context_builder = ContextBuilder()
+        # Bounded pool for the blocking calls (index loading, FAISS search,
+        # query embedding, file I/O) used by the async methods
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("UTILS_MAX_WORKERS", "8"))
+        )
+        # Separate pool for fanning out over indexes, which already runs on the executor
+        self.search_executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("SEARCH_MAX_WORKERS", "8"))
+        )
+
+    async def _run_blocking(self, func, *args):
+        """
+        Runs a blocking function on the bounded executor without blocking the event loop.
+        The function runs in a copy of the caller's context, so its tracing spans are
+        children of the request span.
+
+        Args:
+        - func (callable): The blocking function to run.
+        - *args: Positional arguments passed to the function.
+
+        Returns:
+        - Any: The return value of the function.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            functools.partial(contextvars.copy_context().run, func, *args),
+        )
+
+    def warmup(self, index_names=()):
+        """
+        Builds the LLM and embedding clients and loads indexes into the index cache, so the
+        first queries do not pay for client construction or index loading.
+
+        Args:
+        - index_names (list, optional): The names of the indexes to preload.
+
+        Returns:
+        - dict: The preloaded index names and the warm-up time in seconds.
+        """
+        start = time.perf_counter()
+        loaded = []
+        try:
+            self.llm.llm
+            self.preprocess_doc.warmup()
+            self.context_builder.count_tokens("warm up")
+        except Exception as e:
+            print(f"Error warming up clients: {e}")
+        for name in index_names:
+            try:
+                index = self.index_cache.get(name, self.preprocess_doc.get_index)
+                if index is not None:
+                    self.preprocess_doc.lexical_index(index)
+                    loaded.append(name)
+            except Exception as e:
+                print(f"Error preloading index {name}: {e}")
+        return {"indexes": loaded, "seconds": round(time.perf_counter() - start, 3)}
+
+    async def awarmup(self, index_names=()):
+        """
+        Asynchronously builds the clients and preloads indexes, see `warmup`.
+
+        Args:
+        - index_names (list, optional): The names of the indexes to preload.
+
+        Returns:
+        - dict: The preloaded index names and the warm-up time in seconds.
         """
-        Initializes the Utils class with instances of LLM and PreprocessDoc.
+        return await self._run_blocking(self.warmup, index_names)
+
+    @staticmethod
+    def doc_name(doc):
         """
-        self.llm = LLM()
-        self.preprocess_doc = PreprocessDoc()
-        self.index = None
+        Derives the index name / document ID from the path of an uploaded document.
+
+        Args:
+        - doc (str): The path to the document.
 
-    def upload_doc(self, doc):
+        Returns:
+        - str: The file name without directory, "temp_" prefix and extension, with spaces and
+          other characters not allowed in index names replaced by underscores.
+        """
+        # Remove the "temp_" prefix from the filename
+        original_filename = os.path.basename(doc)
+        if original_filename.startswith("temp_"):
+            original_filename = original_filename[5:]
+        filename = os.path.splitext(original_filename)[0]
+        return re.sub(r"[^\w.-]", "_", filename)
+
+    @staticmethod
+    def validate_index_name(index_name):
+        """
+        Checks that an index name is safe to use as a folder name under faiss_index: 1 to 128
+        letters, digits, underscores, hyphens and dots, not starting with a dot, not made only
+        of dots and not the name of a catalog file. This rules out path separators, the "." and
+        ".." folders, and catalog.json and catalog.lock.
+
+        Args:
+        - index_name (str or list): The name of the index, or a list of names.
+
+        Returns:
+        - str or list: The validated index name or names.
+
+        Raises:
+        - ValueError: If a name is not a valid index name.
+        """
+        names = index_name if isinstance(index_name, (list, tuple)) else [index_name]
+        for name in names:
+            if (
+                not isinstance(name, str)
+                or not INDEX_NAME_PATTERN.fullmatch(name)
+                or name.startswith(".")
+                or not name.strip(".")
+                or IndexCatalog.is_reserved(name)
+            ):
+                raise ValueError(f"Invalid index name: {name!r}")
+        return index_name
+
+    @contextmanager
+    def _write_lock(self, index_name):
+        """
+        Serializes the writers of an index: the threads of this process on a lock per index,
+        and the other worker processes on the file lock of the index.
+        """
+        with self._write_locks_lock:
+            lock = self._write_locks.setdefault(index_name, threading.Lock())
+        with lock, self.preprocess_doc.write_lock(index_name):
+            yield
+
+    def _prepare_doc(self, doc, progress, embedding_function=None):
+        """
+        Parses, chunks and embeds a document, tagging every chunk with the document ID.
+
+        Args:
+        - doc (str): The path to the document.
+        - progress (callable): The progress callback of `upload_doc`.
+        - embedding_function (Embeddings, optional): The embedding function to use. Defaults to
+          the current embedding function.
+
+        Returns:
+        - tuple: The document ID, the chunks and their embeddings.
+        """
+        doc_id = self.doc_name(doc)
+        progress("parsing")
+        chunks, vectors = [], []
+        for batch in self.preprocess_doc.stream_document(
+            doc, doc_id, embedding_function, progress
+        ):
+            for chunk, vector in batch:
+                chunks.append(chunk)
+                vectors.append(vector)
+        if not chunks:
+            raise ValueError("No text could be extracted from the document")
+        return doc_id, chunks, vectors
+
+    def _publish_index(self, index_name, index):
+        """
+        Makes a rewritten index visible to queries.
+
+        Args:
+        - index_name (str): The name of the index.
+        - index (FAISS): The new index.
+        """
+        # The index directory was rewritten, so drop any stale copy and keep the new one hot
+        self.index_cache.invalidate(index_name)
+        self.answer_cache.invalidate(index_name)
+        self.index_cache.put(index_name, index)
+
+    def _drop_index(self, index_name):
+        """
+        Forgets an index whose folder no longer exists: its catalog entry and cached copies.
+
+        Args:
+        - index_name (str): The name of the index.
+        """
+        self.index_cache.invalidate(index_name)
+        self.answer_cache.invalidate(index_name)
+        self.preprocess_doc.index_catalog.remove(index_name)
+
+    def upload_doc(self, doc, progress=None, index_type=None):
         """
         Uploads a document, preprocesses it, and creates an index for future queries.
 
         Args:
         - doc (str): The path to the document to be uploaded.
+        - progress (callable, optional): A function called with the current stage name and
+          keyword counters (pages_parsed, chunks_created, chunks_embedded, throughput, index_written, error).
+        - index_type (str, optional): The FAISS index type, "flat", "hnsw" or "ivf". See
+          `PreprocessDoc.create_index`.
 
         Returns:
         - str: A success message if the document is uploaded successfully.
         """
+        if progress is None:
+            progress = lambda stage, **counts: None
         try:
-            # Remove the "temp_" prefix from the filename
-            original_filename = doc[5:] if doc.startswith("temp_") else doc
-            filename = os.path.splitext(os.path.basename(original_filename))[0]
-            filename = filename.replace(" ", "_")
-            text = self.preprocess_doc.pdf_loader(doc)
-            chunks = self.preprocess_doc.create_chunks(text)
-            self.index = self.preprocess_doc.create_index(chunks, filename)
+            filename = self.validate_index_name(self.doc_name(doc))
+            progress("parsing")
+            # Chunks are added to the index as they are embedded, while later pages are parsed
+            with metrics.timer(stage="build_index"):
+                index = self.preprocess_doc.ingest(
+                    doc, filename, index_type, progress=progress
+                )
+            if index is None:
+                raise ValueError("No text could be extracted from the document")
+            with self._write_lock(filename):
+                self.preprocess_doc.save_index(index, filename)
+                self._publish_index(filename, index)
+            progress("indexed", index_written=True)
+            metrics.inc("ingestions_total", status="succeeded")
             return "Upload Successful!"
         except Exception as e:
             print(f"Error uploading document: {e}")
+            progress("failed", error=str(e))
+            metrics.inc("ingestions_total", status="failed")
             return "Upload Failed."
 
-    def similarity_search(self, query, index_name=""):
+    def add_doc(self, doc, index_name, progress=None):
         """
-        Performs a similarity search based on the query and the current index.
+        Adds a document to an existing index without rebuilding it, replacing the chunks of
+        an earlier version of the same document. Creates the index if it does not exist.
+
+        Args:
+        - doc (str): The path to the document to be added.
+        - index_name (str): The name of the index to add the document to.
+        - progress (callable, optional): A progress callback, as for `upload_doc`.
+
+        Returns:
+        - str: A success message if the document is added successfully.
+        """
+        if progress is None:
+            progress = lambda stage, **counts: None
+        try:
+            self.validate_index_name(index_name)
+            # Embed with the model the existing index was built with
+            embedding_function = self.preprocess_doc.index_embedding_function(
+                index_name
+            )
+            doc_id, chunks, vectors = self._prepare_doc(
+                doc, progress, embedding_function
+            )
+            with self._write_lock(index_name):
+                # Work on a private copy so concurrent queries keep using the published index
+                index = self.preprocess_doc.get_index(index_name, writable=True)
+                if index is None:
+                    index = self.preprocess_doc.create_index(
+                        chunks, index_name, vectors
+                    )
+                    if index is None:
+                        raise ValueError("The index could not be written")
+                else:
+                    self.preprocess_doc.delete_document(index, doc_id)
+                    self.preprocess_doc.add_documents(index, chunks, vectors)
+                    self.preprocess_doc.save_index(index, index_name)
+                self._publish_index(index_name, index)
+            progress("indexed", index_written=True)
+            return "Upload Successful!"
+        except Exception as e:
+            print(f"Error adding document: {e}")
+            progress("failed", error=str(e))
+            return "Upload Failed."
+
+    def delete_doc(self, index_name, doc_id):
+        """
+        Deletes every chunk of a source document from an index.
+
+        Args:
+        - index_name (str): The name of the index.
+        - doc_id (str): The ID of the document, i.e. its file name without extension.
+
+        Returns:
+        - int: The number of deleted chunks.
+
+        Raises:
+        - ValueError: If the index name is not valid.
+        - FileNotFoundError: If the index does not exist.
+        """
+        self.validate_index_name(index_name)
+        if not os.path.isdir(os.path.join("faiss_index", index_name)):
+            self._drop_index(index_name)
+            raise FileNotFoundError(f"Index not found: {index_name}")
+        with self._write_lock(index_name):
+            index = self.preprocess_doc.get_index(index_name, writable=True)
+            if index is None:
+                raise FileNotFoundError(f"Index not found: {index_name}")
+            deleted = self.preprocess_doc.delete_document(index, doc_id)
+            if deleted:
+                self.preprocess_doc.save_index(index, index_name)
+                self._publish_index(index_name, index)
+            return deleted
+
+    async def adelete_doc(self, index_name, doc_id):
+        """
+        Asynchronously deletes every chunk of a source document from an index.
+
+        Args:
+        - index_name (str): The name of the index.
+        - doc_id (str): The ID of the document, i.e. its file name without extension.
+
+        Returns:
+        - int: The number of deleted chunks.
+        """
+        return await self._run_blocking(self.delete_doc, index_name, doc_id)
+
+    def similarity_search(self, query, index_name="", mode=None, vector=None):
+        """
+        Performs a similarity search based on the query and the named index.
 
         Args:
         - query (str): The query to search for in the documents.
-        - index_name (str, optional): The name of the index to use for the search. Defaults to an empty string.
+        - index_name (str or list, optional): The name of the index to use for the search, or a list
+          of names to search them all. Defaults to an empty string.
+        - mode (str, optional): The retrieval mode, "dense", "lexical" or "hybrid". Defaults to the
+          RETRIEVAL_MODE environment variable, or "dense".
+        - vector (list, optional): The embedding of the query by the current embedding function, see
+          `query_embedding`. Only used for the indexes built with that model.
 
         Returns:
         - list: A list of relevant documents based on the query.
         """
+        if isinstance(index_name, (list, tuple)):
+            if len(index_name) != 1:
+                return self.federated_search(
+                    query, index_name, mode=mode, vector=vector
+                )
+            index_name = index_name[0]
         try:
-            if self.index is None:
-                self.index = self.preprocess_doc.get_index(index_name)
-                print(self.index)
-            docs = self.preprocess_doc.get_relevant_documents(query, self.index)
+            self.validate_index_name(index_name)
+            with metrics.timer(stage="retrieval"):
+                index = self.index_cache.get(index_name, self.preprocess_doc.get_index)
+                if index is None:
+                    return []
+                if (
+                    index.embedding_function
+                    is not self.preprocess_doc.embedding_function
+                ):
+                    vector = None
+                docs = self.preprocess_doc.get_relevant_documents(
+                    query, index, mode, vector=vector
+                )
             return docs
         except Exception as e:
             print(f"Error performing similarity search: {e}")
             return []
 
+    def federated_search(self, query, index_names, k=3, mode=None, vector=None):
+        """
+        Searches several indexes in parallel and merges the results into a global top k.
+        The query is embedded once per embedding model used by the indexes.
+
+        Args:
+        - query (str): The query to search for in the documents.
+        - index_names (list): The names of the indexes to search.
+        - k (int, optional): The number of documents to return. Defaults to 3.
+        - mode (str, optional): The retrieval mode, "dense", "lexical" or "hybrid". Defaults to the
+          RETRIEVAL_MODE environment variable, or "dense".
+        - vector (list, optional): The embedding of the query by the current embedding function.
+
+        Returns:
+        - list: The k most relevant documents across the indexes, each tagged with its index_name.
+        """
+        try:
+            names = self.validate_index_name(list(dict.fromkeys(index_names)))
+            # Each search runs in a copy of this context, so its spans join the request trace
+            context = contextvars.copy_context()
+            indexes = list(
+                self.search_executor.map(
+                    lambda name: context.copy().run(
+                        self.index_cache.get, name, self.preprocess_doc.get_index
+                    ),
+                    names,
+                )
+            )
+            found = [(name, index) for name, index in zip(names, indexes) if index]
+            if not found:
+                return []
+
+            if mode is None:
+                mode = os.environ.get("RETRIEVAL_MODE", "dense")
+
+            # Embed the query once per distinct embedding model
+            vectors = {}
+            if vector is not None:
+                vectors[id(self.preprocess_doc.embedding_function)] = vector
+            if mode != "lexical":
+                for _, index in found:
+                    function = index.embedding_function
+                    if id(function) not in vectors:
+                        with metrics.timer(stage="embed_query"):
+                            vectors[id(function)] = function.embed_query(query)
+
+            def search(item):
+                name, index = item
+                if mode != "dense":
+                    # Lexical and fused scores are ranks within an index, merged by rank below
+                    docs = self.preprocess_doc.get_relevant_documents(
+                        query, index, mode, k, vectors.get(id(index.embedding_function))
+                    )
+                    return [(name, rank, doc, 0) for rank, doc in enumerate(docs)]
+                vector = vectors[id(index.embedding_function)]
+                hits = self.preprocess_doc.get_relevant_documents_by_vector(
+                    vector, index, k
+                )
+                return [
+                    (name, rank, doc, score) for rank, (doc, score) in enumerate(hits)
+                ]
+
+            hits = [
+                hit
+                for result in self.search_executor.map(
+                    lambda item: context.copy().run(search, item), found
+                )
+                for hit in result
+            ]
+            if mode == "dense" and len(vectors) == 1:
+                hits.sort(key=lambda hit: hit[3])
+            else:
+                # Distances from different models are not comparable, so interleave by rank
+                hits.sort(key=lambda hit: (hit[1], hit[3]))
+            # Copy the documents so the tag does not leak into the cached docstores
+            return [
+                doc.copy(update={"metadata": {**doc.metadata, "index_name": name}})
+                for name, _, doc, _ in hits[:k]
+            ]
+        except Exception as e:
+            print(f"Error performing federated search: {e}")
+            return []
+
+    async def asimilarity_search(self, query, index_name="", mode=None, vector=None):
+        """
+        Asynchronously performs a similarity search based on the query and the named index.
+
+        Args:
+        - query (str): The query to search for in the documents.
+        - index_name (str, optional): The name of the index to use for the search. Defaults to an empty string.
+        - mode (str, optional): The retrieval mode, "dense", "lexical" or "hybrid".
+        - vector (Future, optional): The future returned by `submit_query_embedding` for the query.
+
+        Returns:
+        - list: A list of relevant documents based on the query.
+        """
+        if vector is not None:
+            vector = await asyncio.wrap_future(vector)
+        return await self._run_blocking(
+            self.similarity_search, query, index_name, mode, vector
+        )
+
+    def query_embedding(self, query, index_name, mode=None):
+        """
+        Embeds a query with the current embedding function, so retrieval and the answer cache
+        can share the embedding of a query that was not rephrased.
+
+        Args:
+        - query (str): The query.
+        - index_name (str or list): The name of the index to search, or a list of names.
+        - mode (str, optional): The retrieval mode of the request.
+
+        Returns:
+        - list or None: The embedding, or None in "lexical" mode, when none of the indexes was
+          built with the current model, or when embedding failed.
+        """
+        if not self._embeds_query(mode):
+            return None
+        names = index_name if isinstance(index_name, (list, tuple)) else [index_name]
+        try:
+            function = self.preprocess_doc.embedding_function
+            if all(
+                self.preprocess_doc.index_embedding_function(name) is not function
+                for name in names
+            ):
+                return None
+            with metrics.timer(stage="embed_query"):
+                return function.embed_query(query)
+        except Exception as e:
+            print(f"Error embedding query: {e}")
+            return None
+
+    def submit_query_embedding(self, query, index_name, mode=None):
+        """
+        Starts `query_embedding` on the executor, without waiting for it.
+
+        Args:
+        - query (str): The query.
+        - index_name (str or list): The name of the index to search, or a list of names.
+        - mode (str, optional): The retrieval mode of the request.
+
+        Returns:
+        - Future: The future of the embedding, to pass to `asimilarity_search` and `alookup_answer`.
+        """
+        return self.executor.submit(
+            contextvars.copy_context().run,
+            self.query_embedding,
+            query,
+            index_name,
+            mode,
+        )
+
     def get_conv(self, id):
         """
-        Retrieves a conversation history based on the given ID.
+        Retrieves the latest turn of a conversation history based on the given ID.
 
         Args:
         - id (str): The ID of the conversation to retrieve.
@@ -67,26 +563,16 @@ class Utils:
         Returns:
         - list: A list of conversation history, with each entry being a dictionary containing 'role' and 'content'.
         """
-        conv_folder = "conv"
-        conv = [
-            {"role": "user", "content": "Hi"},
-            {"role": "assistant", "content": "Hello, How can I help you?"},
-        ]
-
         try:
-            if os.path.exists(conv_folder):
-                files = [f for f in os.listdir(conv_folder) if f.endswith(".json")]
-                if id + ".json" in files:
-                    with open(os.path.join(conv_folder, id + ".json"), "r") as f:
-                        conv = json.load(f)
-            return conv[-2:]  # Return the last two entries of the conversation
+            # Return the last two entries of the conversation
+            return self.conv_store.tail(id, 2) or list(self.DEFAULT_CONV)
         except Exception as e:
             print(f"Error retrieving conversation: {e}")
             return []
 
     def save_conv(self, id, conv):
         """
-        Saves or updates a conversation history based on the given ID and conversation data.
+        Appends a conversation turn to the history of the given ID.
 
         Args:
         - id (str): The ID of the conversation to save or update.
@@ -95,34 +581,31 @@ class Utils:
         Returns:
         - str: A success message if the conversation is saved successfully.
         """
-        conv_folder = "conv"
         try:
-            if not os.path.exists(conv_folder):
-                os.makedirs(conv_folder)
-
-            file_path = os.path.join(conv_folder, id + ".json")
-
-            if os.path.exists(file_path):
-                # If file exists, read existing conversation and extend it
-                with open(file_path, "r") as f:
-                    existing_conv = json.load(f)
-                existing_conv.extend(conv)
-                conv_to_save = existing_conv
-            else:
-                # If file doesn't exist, use the new conversation
-                conv_to_save = conv
-
-            # Save the conversation (either extended or new)
-            with open(file_path, "w") as f:
-                json.dump(conv_to_save, f)
+            with metrics.timer(stage="save_conv"):
+                self.conv_store.append(id, conv)
             return f"Save Successful for {id}"
         except Exception as e:
             print(f"Error saving conversation: {e}")
             return f"Save Failed for {id}"
 
+    async def asave_conv(self, id, conv):
+        """
+        Asynchronously saves or updates a conversation history.
+
+        Args:
+        - id (str): The ID of the conversation to save or update.
+        - conv (list): A list of conversation history, with each entry being a dictionary containing 'role' and 'content'.
+
+        Returns:
+        - str: A success message if the conversation is saved successfully.
+        """
+        return await self._run_blocking(self.save_conv, id, conv)
+
     def rephrase(self, data):
         """
-        Rephrases a query based on the conversation history.
+        Rephrases a query based on the conversation history. The LLM is only called when
+        the RephraseRouter cannot pass the query through or answer it from its cache.
 
         Args:
         - data (dict): A dictionary containing 'id' and 'query' for the conversation and query to be rephrased.
@@ -132,78 +615,413 @@ class Utils:
         """
         try:
             conv = self.get_conv(data["id"])
-            return self.llm.rephrase(data["query"], conv)
+            rephrased = self.rephrase_router.route(data["query"], conv)
+            if rephrased is None:
+                rephrased = self.llm.rephrase(data["query"], conv)
+                self.rephrase_router.store(data["query"], conv, rephrased)
+            return rephrased
         except Exception as e:
             print(f"Error rephrasing query: {e}")
             return "Failed to rephrase query."
 
-    def qa(self, query, context):
+    async def arephrase(self, data):
+        """
+        Asynchronously rephrases a query based on the conversation history.
+
+        Args:
+        - data (dict): A dictionary containing 'id' and 'query' for the conversation and query to be rephrased.
+
+        Returns:
+        - str: The rephrased query.
+        """
+        try:
+            conv = await self._run_blocking(self.get_conv, data["id"])
+            rephrased = self.rephrase_router.route(data["query"], conv)
+            if rephrased is None:
+                rephrased = await self.llm.arephrase(data["query"], conv)
+                self.rephrase_router.store(data["query"], conv, rephrased)
+            return rephrased
+        except Exception as e:
+            print(f"Error rephrasing query: {e}")
+            return "Failed to rephrase query."
+
+    @staticmethod
+    def _answer_cache_key(index_name):
+        # Federated answers are cached under the sorted tuple of their index names
+        if isinstance(index_name, (list, tuple)):
+            names = tuple(sorted(set(index_name)))
+            return names[0] if len(names) == 1 else names
+        return index_name
+
+    def build_context(self, query, docs):
+        """
+        Builds the QA prompt context from the retrieved documents and measures the prompt.
+
+        Args:
+        - query (str): The question to be answered.
+        - docs (list): The retrieved documents, most relevant first.
+
+        Returns:
+        - tuple: The context text and the size of the prompt in tokens.
+        """
+        context = self.context_builder.build(docs)
+        prompt_tokens = self.context_builder.count_tokens(
+            system_prompt.format(context)
+        ) + self.context_builder.count_tokens(query)
+        self.context_builder.record(prompt_tokens)
+        metrics.observe("prompt_tokens", prompt_tokens, buckets=TOKEN_BUCKETS)
+        print(f"Prompt size: {prompt_tokens} tokens")
+        return context, prompt_tokens
+
+    async def abuild_context(self, query, docs):
+        """
+        Asynchronously builds the QA prompt context from the retrieved documents and measures the prompt.
+
+        Args:
+        - query (str): The question to be answered.
+        - docs (list): The retrieved documents, most relevant first.
+
+        Returns:
+        - tuple: The context text and the size of the prompt in tokens.
+        """
+        return await self._run_blocking(self.build_context, query, docs)
+
+    @staticmethod
+    def _embeds_query(mode):
+        # Lexical retrieval never embeds the query, so neither does the answer cache
+        return (mode or os.environ.get("RETRIEVAL_MODE", "dense")) != "lexical"
+
+    def _lookup_answer(self, query, index_name, mode=None, vector=None):
+        """
+        Looks up a cached answer, returning (None, None) when caching is not requested. When
+        the future of the query's embedding is given, it is used instead of embedding the query.
+        """
+        if index_name is None:
+            return None, None
+        embed = self._embeds_query(mode)
+        if embed and vector is not None:
+            embed = vector.result
+        answer, query_vector = self.answer_cache.lookup(
+            self._answer_cache_key(index_name), query, embed
+        )
+        metrics.inc(
+            "answer_cache_lookups_total", result="miss" if answer is None else "hit"
+        )
+        if answer is None and query_vector is None and callable(embed):
+            # Retrieval waits for the embedding before generation anyway, so storing the
+            # answer need not embed the query again
+            query_vector = embed()
+            if query_vector is not None:
+                query_vector = self.answer_cache.normalize(query_vector)
+        return answer, query_vector
+
+    async def alookup_answer(self, query, index_name, mode=None, vector=None):
+        """
+        Asynchronously looks up a cached answer, e.g. while retrieval is still running.
+
+        Args:
+        - query (str): The rephrased query.
+        - index_name (str or list): The index or indexes the answer would be generated from.
+        - mode (str, optional): The retrieval mode of the request.
+        - vector (Future, optional): The future returned by `submit_query_embedding`, only to be
+          passed when the rephrased query is the query that was embedded.
+
+        Returns:
+        - tuple: The cached answer (or None on a miss) and the query embedding, to pass as
+          `cached` to `aqa` or `aqa_stream`.
+        """
+        return await self._run_blocking(
+            self._lookup_answer, query, index_name, mode, vector
+        )
+
+    def _store_answer(self, query, index_name, answer, vector, mode=None):
+        """
+        Caches a generated answer on the executor, without waiting for it, unless caching is
+        not requested or generation failed. The query is embedded there if `lookup` did not,
+        so the response is not delayed by the extra embedding call.
+        """
+        if index_name is None or not answer or answer == "Failed to answer question.":
+            return
+
+        def store():
+            try:
+                self.answer_cache.store(
+                    self._answer_cache_key(index_name),
+                    query,
+                    answer,
+                    vector,
+                    self._embeds_query(mode),
+                )
+            except Exception as e:
+                print(f"Error caching answer: {e}")
+
+        self.executor.submit(store)
+
+    def qa(self, query, context, index_name=None, mode=None, cached=None):
         """
         Answers a question based on the given context.
 
         Args:
         - query (str): The question to be answered.
         - context (str): The context in which the question is asked.
+        - index_name (str, optional): The index the context was retrieved from. When given, answers
+          are served from and saved to the answer cache of that index.
+        - mode (str, optional): The retrieval mode of the request. The answer cache does not embed
+          the query in "lexical" mode.
+        - cached (tuple, optional): The result of `alookup_answer` if the answer cache was already
+          checked, so it is not checked again.
 
         Returns:
         - str: The answer to the question.
         """
         try:
-            return self.llm.qa(query, context)
+            answer, vector = cached or self._lookup_answer(query, index_name, mode)
+            if answer is not None:
+                return answer
+            answer = self.llm.qa(query, context)
+            self._store_answer(query, index_name, answer, vector, mode)
+            return answer
         except Exception as e:
             print(f"Error answering question: {e}")
             return "Failed to answer question."
 
-    def get_all_indexes(self):
+    async def aqa(self, query, context, index_name=None, mode=None, cached=None):
         """
-        Retrieve and display all possible indexes present in the 'faiss_index' folder.
-        Each index is represented by a subfolder in the 'faiss_index' folder.
-        The '.pdf' extension is removed from the index names.
+        Asynchronously answers a question based on the given context.
+
+        Args:
+        - query (str): The question to be answered.
+        - context (str): The context in which the question is asked.
+        - index_name (str, optional): The index the context was retrieved from. When given, answers
+          are served from and saved to the answer cache of that index.
+        - mode (str, optional): The retrieval mode of the request. The answer cache does not embed
+          the query in "lexical" mode.
+        - cached (tuple, optional): The result of `alookup_answer` if the answer cache was already
+          checked, so it is not checked again.
 
         Returns:
-        list: A list of all index names (subfolder names in 'faiss_index' without '.pdf' extension)
+        - str: The answer to the question.
         """
-        index_folder = "faiss_index"
         try:
-            if os.path.exists(index_folder):
-                # List all subdirectories in the 'faiss_index' folder
-                # Each subdirectory represents an index
-                index_names = [
-                    f
-                    for f in os.listdir(index_folder)
-                    if os.path.isdir(os.path.join(index_folder, f))
-                ]
+            answer, vector = cached or await self.alookup_answer(
+                query, index_name, mode
+            )
+            if answer is not None:
+                return answer
+            answer = await self.llm.aqa(query, context)
+            self._store_answer(query, index_name, answer, vector, mode)
+            return answer
+        except Exception as e:
+            print(f"Error answering question: {e}")
+            return "Failed to answer question."
 
-                # Remove '.pdf' extension from each index name
-                index_names = [os.path.splitext(name)[0] for name in index_names]
+    def qa_stream(self, query, context, index_name=None, mode=None, cached=None):
+        """
+        Answers a question based on the given context, yielding the answer as it is generated.
 
-                return index_names
-            else:
-                return []
+        Args:
+        - query (str): The question to be answered.
+        - context (str): The context in which the question is asked.
+        - index_name (str, optional): The index the context was retrieved from. When given, answers
+          are served from and saved to the answer cache of that index.
+        - mode (str, optional): The retrieval mode of the request. The answer cache does not embed
+          the query in "lexical" mode.
+        - cached (tuple, optional): The result of `alookup_answer` if the answer cache was already
+          checked, so it is not checked again.
+
+        Yields:
+        - str: The next piece of the answer.
+        """
+        answer, vector = cached or self._lookup_answer(query, index_name, mode)
+        if answer is not None:
+            yield answer
+            return
+        tokens = []
+        completed = False
+        try:
+            for token in self.llm.qa_stream(query, context, raise_errors=True):
+                tokens.append(token)
+                yield token
+            completed = True
+        except Exception as e:
+            print(f"Error answering question: {e}")
+            yield "Failed to answer question."
+        # A partial answer is never cached
+        if completed:
+            self._store_answer(query, index_name, "".join(tokens), vector, mode)
+
+    async def aqa_stream(self, query, context, index_name=None, mode=None, cached=None):
+        """
+        Asynchronously answers a question based on the given context, yielding the answer as it is generated.
+
+        Args:
+        - query (str): The question to be answered.
+        - context (str): The context in which the question is asked.
+        - index_name (str, optional): The index the context was retrieved from. When given, answers
+          are served from and saved to the answer cache of that index.
+        - mode (str, optional): The retrieval mode of the request. The answer cache does not embed
+          the query in "lexical" mode.
+        - cached (tuple, optional): The result of `alookup_answer` if the answer cache was already
+          checked, so it is not checked again.
+
+        Yields:
+        - str: The next piece of the answer.
+        """
+        answer, vector = cached or await self.alookup_answer(query, index_name, mode)
+        if answer is not None:
+            yield answer
+            return
+        tokens = []
+        completed = False
+        try:
+            async for token in self.llm.aqa_stream(query, context, raise_errors=True):
+                tokens.append(token)
+                yield token
+            completed = True
+        except Exception as e:
+            print(f"Error answering question: {e}")
+            yield "Failed to answer question."
+        # A partial answer is never cached
+        if completed:
+            self._store_answer(query, index_name, "".join(tokens), vector, mode)
+
+    def get_all_indexes(self, prefix="", cursor=None, limit=None):
+        """
+        Retrieves the names of the saved indexes from the index catalog, in name order,
+        without listing the 'faiss_index' folder.
+
+        Args:
+        - prefix (str, optional): Only return the indexes whose name starts with this prefix.
+        - cursor (str, optional): Only return the indexes after this name, i.e. the last name of the previous page.
+        - limit (int, optional): The maximum number of names to return. Defaults to all.
+
+        Returns:
+        list: A list of index names.
+        """
+        try:
+            page, _ = self.preprocess_doc.index_catalog.list(prefix, cursor, limit)
+            return [name for name, _ in page]
         except Exception as e:
             print(f"Error retrieving indexes: {e}")
             return []
 
-    def get_all_convs(self):
+    def get_index_catalog(self, prefix="", cursor=None, limit=None):
+        """
+        Retrieves a page of the index catalog: the saved indexes with their chunk count,
+        size, embedding model and build time.
+
+        Args:
+        - prefix (str, optional): Only return the indexes whose name starts with this prefix.
+        - cursor (str, optional): Only return the indexes after this name, i.e. the next_cursor of the previous page.
+        - limit (int, optional): The maximum number of indexes to return. Defaults to all.
+
+        Returns:
+        - dict: The indexes and the cursor of the next page, or None on the last page.
+        """
+        page, next_cursor = self.preprocess_doc.index_catalog.list(
+            prefix, cursor, limit
+        )
+        return {
+            "indexes": [{"name": name, **metadata} for name, metadata in page],
+            "next_cursor": next_cursor,
+        }
+
+    def list_convs(self, cursor=None, limit=50):
+        """
+        Retrieves a page of the conversation catalog, most recently updated first.
+
+        Args:
+        - cursor (str, optional): The next_cursor returned with the previous page.
+        - limit (int, optional): The maximum number of conversations to return. Defaults to 50.
+
+        Returns:
+        - dict: The conversations with their creation time, last update time, message count and
+          size, and the cursor of the next page, or None on the last page.
+        """
+        conversations, next_cursor = self.conv_store.list(cursor, limit)
+        return {"conversations": conversations, "next_cursor": next_cursor}
+
+    async def alist_convs(self, cursor=None, limit=50):
+        """
+        Asynchronously retrieves a page of the conversation catalog, see `list_convs`.
+
+        Args:
+        - cursor (str, optional): The next_cursor returned with the previous page.
+        - limit (int, optional): The maximum number of conversations to return. Defaults to 50.
+
+        Returns:
+        - dict: The conversations and the cursor of the next page.
+        """
+        return await self._run_blocking(self.list_convs, cursor, limit)
+
+    def get_conv_history(self, id, limit=None):
         """
-        Retrieves all conversation files present in the 'conv' folder.
+        Retrieves the history of a conversation.
+
+        Args:
+        - id (str): The ID of the conversation.
+        - limit (int, optional): Only return the last limit messages. Defaults to all.
 
         Returns:
-        list: A list of all conversation file names.
+        - list: The messages of the conversation, oldest first. Empty if the conversation does not exist.
+
+        Raises:
+        - ValueError: If the ID is not a valid conversation ID or limit is less than 1.
+        """
+        self.conv_store.validate_id(id)
+        if limit is not None:
+            return self.conv_store.tail(id, limit)
+        return self.conv_store.read_all(id)
+
+    async def aget_conv_history(self, id, limit=None):
         """
-        conv_folder = "conv"
+        Asynchronously retrieves the history of a conversation.
+
+        Args:
+        - id (str): The ID of the conversation.
+        - limit (int, optional): Only return the last limit messages. Defaults to all.
+
+        Returns:
+        - list: The messages of the conversation, oldest first.
+        """
+        return await self._run_blocking(self.get_conv_history, id, limit)
+
+    def compact_convs(self, max_age=None):
+        """
+        Deletes the conversations that have not been updated within the retention period.
+
+        Args:
+        - max_age (float, optional): The retention period in seconds. Defaults to the
+          CONV_RETENTION_DAYS environment variable in days. Nothing is deleted if it is not set.
+
+        Returns:
+        - int: The number of deleted conversations.
+        """
+        if max_age is None:
+            days = float(os.environ.get("CONV_RETENTION_DAYS", "0"))
+            if days <= 0:
+                return 0
+            max_age = days * 86400
         try:
-            conv_files = []
-            if os.path.exists(conv_folder):
-                conv_files = [
-                    f
-                    for f in os.listdir(conv_folder)
-                    if os.path.isfile(os.path.join(conv_folder, f))
-                ]
-            return conv_files  # This will be an empty list if no files are present
+            deleted = self.conv_store.compact(max_age)
+            if deleted:
+                print(f"Deleted {deleted} expired conversations")
+            return deleted
         except Exception as e:
-            print(f"Error retrieving conversations: {e}")
-            return []
+            print(f"Error compacting conversations: {e}")
+            return 0
+
+    async def acompact_convs(self, max_age=None):
+        """
+        Asynchronously deletes the expired conversations, see `compact_convs`.
+
+        Args:
+        - max_age (float, optional): The retention period in seconds.
+
+        Returns:
+        - int: The number of deleted conversations.
+        """
+        return await self._run_blocking(self.compact_convs, max_age)
 
 
 if __name__ == "__main__":